@@ -1,20 +1,29 @@
 import gymnasium as gym
 import numpy as np
 
-import matplotlib
-import matplotlib.pyplot as plt
-
 import random
 import torch
-from torch import nn
 import yaml
 
-from replay_memory import ReplayMemory
+from replay_memory import (ReplayMemory, ArrayReplayMemory, MmapReplayMemory, EpisodicReplayMemory,
+                           PrioritizedReplayMemory, compact_observation_dtype)
+from prefetcher import BatchPrefetcher
+from n_step import NStepBuffer
 from dqn import DQN
+from td_loss import TDLoss
+from learner import AsyncLearner
+from distributed import ActorPool, actor_epsilons
+from checkpoint_writer import CheckpointWriter
+from history import EpisodeHistory
+from metrics_stream import MetricsStream, start_plotter, stop_plotter
+from metrics_writer import MetricsWriter
+from timing import PhaseTimers, NullTimers
 
 from datetime import datetime, timedelta
 import argparse
+import contextlib
 import itertools
+import time
 
 import flappy_bird_gymnasium
 
@@ -25,9 +34,20 @@ DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
 RUNS_DIR = 'runs'
 
+GRAPH_MEAN_WINDOW = 100  # episodes in the plotted moving average of the rewards
+METRICS_FLUSH_INTERVAL = 1  # seconds between making new metrics visible to the plotter
+GRAPH_UPDATE_INTERVAL = 10  # seconds between plotter redraws
+STEPS_PER_SEC_WINDOW = 5  # seconds the env steps/sec in the episode metrics are measured over
+
 os.makedirs(RUNS_DIR, exist_ok=True)
 
-matplotlib.use('Agg')
+
+def resident_set_bytes():  # current resident set size of this process, None where /proc isn't available
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
 
 
 class Agent:
@@ -56,156 +76,632 @@ class Agent:
             self.max_iter = self.hyperparams.get('max_iter', 1000000)
             self.rewards_to_average = self.hyperparams.get('rewards_to_average', 1)
             self.no_graph = self.hyperparams.get('no_graph', False)
+            # replay storage backend: 'array', 'prioritized', 'mmap', 'episodic' or 'deque'
+            self.replay_memory_type = self.hyperparams.get('replay_memory_type', 'array')
+            # memory budget for the replay buffer in bytes, overrides replay_memory_size when set
+            self.replay_memory_bytes = self.hyperparams.get('replay_memory_bytes', None)
+            self.replay_log_interval = self.hyperparams.get('replay_log_interval', 600)  # seconds between size reports
+            # dtype observations are stored in, 'auto' picks the smallest lossless one for the observation space
+            self.replay_obs_dtype = self.hyperparams.get('replay_obs_dtype', 'auto')
+            # number of mini batches a background thread keeps ready, 0 samples inline
+            self.prefetch_batches = self.hyperparams.get('prefetch_batches', 0)
+            self.seed = self.hyperparams.get('seed', None)  # seeds the replay memory's own sampling stream
+            self.n_step = self.hyperparams.get('n_step', 1)  # steps of real reward before bootstrapping from the target
+            self.num_envs = self.hyperparams.get('num_envs', 1)  # envs stepped together as one vector env when training
+            self.async_envs = self.hyperparams.get('async_envs', False)  # step the sub-envs in subprocesses
+            # env steps between updates, when unset the policy is updated once at the end of every episode
+            self.train_freq = self.hyperparams.get('train_freq', None)
+            self.gradient_steps = self.hyperparams.get('gradient_steps', 1)  # updates each time train_freq comes up
+            self.learning_starts = self.hyperparams.get('learning_starts', 0)  # env steps collected before learning
+            # when set, the target network moves towards the policy network by this fraction (polyak averaging)
+            # every target_update_interval env steps instead of being overwritten with a copy
+            self.target_update_tau = self.hyperparams.get('target_update_tau', None)
+            self.target_update_interval = self.hyperparams.get('target_update_interval', self.network_sync_rate)
+            # compile the loss computation: False, True (torch.compile, falling back to TorchScript) or 'torchscript'
+            self.compile_optimize = self.hyperparams.get('compile_optimize', False)
+            # run the gradient updates on a background thread while the main thread keeps acting
+            self.async_learner = self.hyperparams.get('async_learner', False)
+            # scheduled updates the acting copy of the policy may be missing before it has to be refreshed
+            self.max_policy_staleness = self.hyperparams.get('max_policy_staleness', 4)
+            self.actor_threads = self.hyperparams.get('actor_threads', None)  # torch intra-op threads for acting
+            self.learner_threads = self.hyperparams.get('learner_threads', None)  # and for the learner thread
+            # actor processes feeding this one (the learner) with transitions, 0 runs everything in one process
+            self.num_actors = self.hyperparams.get('num_actors', 0)
+            # actor i explores with actor_epsilon^(1 + actor_epsilon_alpha * i / (num_actors - 1)), fixed, like Ape-X
+            self.actor_epsilon = self.hyperparams.get('actor_epsilon', 0.4)
+            self.actor_epsilon_alpha = self.hyperparams.get('actor_epsilon_alpha', 7)
+            self.weight_broadcast_interval = self.hyperparams.get('weight_broadcast_interval', 100)  # in updates
+            self.actor_channel_size = self.hyperparams.get('actor_channel_size', 4096)  # transitions in flight per actor
+            self.checkpoint_interval = self.hyperparams.get('checkpoint_interval', 600)  # seconds between checkpoints
+            self.checkpoint_replay = self.hyperparams.get('checkpoint_replay', True)  # include the replay memory
+            # seconds between writing the buffered per episode / per update metrics out to runs/<option>/metrics
+            self.metrics_flush_interval = self.hyperparams.get('metrics_flush_interval', 30)
+            self.metrics_format = self.hyperparams.get('metrics_format', 'csv')  # 'csv' or 'parquet' (needs pyarrow)
+            self.timing = self.hyperparams.get('timing', False)  # time the phases of the training loop
+            self.timing_report_interval = self.hyperparams.get('timing_report_interval', 60)  # seconds between tables
+            self.priority_alpha = self.hyperparams.get('priority_alpha', 0.6)  # prioritized replay only
+            self.priority_beta = self.hyperparams.get('priority_beta', 0.4)
+            self.priority_beta_increment = self.hyperparams.get('priority_beta_increment', 0.0)
 
-            self.loss_fn = nn.MSELoss()  # loss function (mean squared error)
             self.optimizer = None
+            self.policy_lock = contextlib.nullcontext()  # held while changing or copying the networks, see run()
+            self.actor_pool = None  # the actor processes learn() broadcasts weights to in distributed mode
 
             self.LOG_FILE = os.path.join(RUNS_DIR, f'{self.hyperparam_option}.log')
             self.MODEL_FILE = os.path.join(RUNS_DIR, f'{self.hyperparam_option}.pt')
             self.GRAPH_FILE = os.path.join(RUNS_DIR, f'{self.hyperparam_option}.png')
+            self.METRICS_FILE = os.path.join(RUNS_DIR, f'{self.hyperparam_option}.metrics')
+            self.REPLAY_DIR = os.path.join(RUNS_DIR, self.hyperparam_option, 'replay')
+            self.CHECKPOINT_DIR = os.path.join(RUNS_DIR, self.hyperparam_option, 'checkpoint')
+            self.METRICS_DIR = os.path.join(RUNS_DIR, self.hyperparam_option, 'metrics')
 
-    def run(self, is_train, render=False):
+    def run(self, is_train, render=False, resume=False):
         if not is_train:
             self.env_make_params['render_mode'] = 'human'
+        self.create_timers()
         if is_train:
             start_time = datetime.now()
-            last_graph_update_time = start_time
+            self.last_metrics_flush_time = start_time
+            self.last_checkpoint_time = start_time
 
-            log_message = f"{start_time.strftime(DATE_FORMAT)}: Training starting..."
+            log_message = f"{start_time.strftime(DATE_FORMAT)}: Training {'resuming' if resume else 'starting'}..."
             print(log_message)
-            with open(self.LOG_FILE, 'w') as file:
+            with open(self.LOG_FILE, 'a' if resume else 'w') as file:
                 file.write(log_message + '\n')
         # run the agent
-        env = gym.make(self.env_id, **self.env_make_params)
+        if is_train and self.num_envs > 1:
+            # sub-envs are stepped as one batch and reset automatically when their episodes end
+            env = gym.make_vec(self.env_id, num_envs=self.num_envs,
+                               vectorization_mode='async' if self.async_envs else 'sync', **self.env_make_params)
+            observation_space, action_space = env.single_observation_space, env.single_action_space
+        else:
+            env = gym.make(self.env_id, **self.env_make_params)
+            observation_space, action_space = env.observation_space, env.action_space
 
-        num_actions = env.action_space.n  # number of output options
-        num_states = env.observation_space.shape[0]  # number of input nodes
-        rewards_per_episode = []  # track rewards
+        num_actions = int(action_space.n)  # number of output options (a numpy int, which TorchScript rejects)
+        num_states = observation_space.shape[0]  # number of input nodes
 
-        policy_net = DQN(num_states, num_actions, self.fc1_nodes).to(self.device)  # the policy network
+        self.policy_net = DQN(num_states, num_actions, self.fc1_nodes).to(self.device)  # the policy network
+        # the network actions are picked with, a separate copy when the learner runs on its own thread
+        self.acting_net = self.policy_net
+        self.create_acting_buffers(num_states)
+        if self.actor_threads is not None:
+            torch.set_num_threads(self.actor_threads)
 
         if is_train:
-            memory = ReplayMemory(capacity=10000)
-            epsilon = self.epsilon_init
-            target_net = DQN(num_states, num_actions, self.fc1_nodes).to(self.device)
-            target_net.load_state_dict(policy_net.state_dict())
-
-            # List to keep track of epsilon decay
-            epsilon_history = []
-
-            step_count = 0
+            self.memory = self.create_memory(observation_space, resume)
+            self.last_replay_log_time = datetime.now()
+            self.log_replay_size(self.memory)
+
+            # appends and samples go through the prefetcher when it's enabled
+            # the async learner needs it too, it's what keeps appends and samples from stepping on each other
+            self.prefetcher = None
+            self.replay = self.memory
+            if self.prefetch_batches > 0 or self.async_learner:
+                self.prefetcher = BatchPrefetcher(self.memory, self.mini_batch_size,
+                                                  queue_size=max(self.prefetch_batches, 1))
+                self.replay = self.prefetcher
+
+            self.epsilon = self.epsilon_init
+            self.target_net = DQN(num_states, num_actions, self.fc1_nodes).to(self.device)
+            self.target_net.load_state_dict(self.policy_net.state_dict())
+            self.target_net.requires_grad_(False)  # only ever copied or blended into, never trained
+            self.target_params = list(self.target_net.parameters())
+            self.policy_params = list(self.policy_net.parameters())
+
+            # keep track of the reward averages in fixed-size windows, the per episode numbers go to the metrics
+            # stream, which a separate process turns into the graph
+            self.history = EpisodeHistory(GRAPH_MEAN_WINDOW, max(self.rewards_to_average, 1))
+
+            self.step_count = 0  # env steps since the last target network update
+            self.updates_since_sync = 0
+            self.total_updates = 0
+            self.total_steps = 0
+            self.steps_since_train = 0
 
             # policy network optimizer
-            self.optimizer = torch.optim.Adam(policy_net.parameters(), lr=self.learning_rate_a)
-
-            best_reward = -float('inf')
+            self.optimizer = torch.optim.Adam(self.policy_net.parameters(), lr=self.learning_rate_a)
+            self.td_loss = self.create_td_loss(num_states)
+
+            self.checkpoint_writer = CheckpointWriter()  # model and checkpoint files are written in the background
+            self.best_reward = -float('inf')
+            self.start_episode = 0
+            if resume:
+                self.load_checkpoint()
+            self.metrics = MetricsStream(self.METRICS_FILE, start_episode=self.start_episode)
+            self.plotter = None if self.no_graph else start_plotter(self.METRICS_FILE, self.GRAPH_FILE,
+                                                                    interval=GRAPH_UPDATE_INTERVAL)
+            # full resolution metrics for looking at afterwards, buffered and written out in chunks
+            self.metrics_writer = MetricsWriter(self.METRICS_DIR, self.metrics_flush_interval, self.metrics_format,
+                                                resume=resume)
+            self.episode_metrics = self.metrics_writer.table(
+                'episodes', ('episode', 'reward', 'length', 'epsilon', 'total_steps', 'steps_per_sec', 'time'))
+            self.update_metrics = self.metrics_writer.table('updates', ('update', 'loss', 'q_mean'))
+            self.rate_window_start = (time.perf_counter(), self.total_steps)
+            self.steps_per_sec = None
+
+            self.learner = None
+            self.policy_lock = contextlib.nullcontext()  # held while touching networks the learner may be updating
+            if self.async_learner:
+                self.acting_net = DQN(num_states, num_actions, self.fc1_nodes).to(self.device)
+                self.acting_net.load_state_dict(self.policy_net.state_dict())
+                self.acting_net.requires_grad_(False)
+                self.learner = AsyncLearner(self.learn, self.update_target, self.policy_net, self.acting_net,
+                                            self.max_policy_staleness, num_threads=self.learner_threads)
+                self.policy_lock = self.learner.lock
         else:
             print(f"Loading model from {self.MODEL_FILE}")
-            policy_net.load_state_dict(torch.load(self.MODEL_FILE))
-            policy_net.eval()
+            self.policy_net.load_state_dict(torch.load(self.MODEL_FILE))
+            self.policy_net.eval()
+
+        if is_train and self.num_actors > 0:
+            env.close()  # only needed for the spaces, the actors make their own
+            self.run_distributed(num_states, num_actions)
+        elif is_train and self.num_envs > 1:
+            self.run_vectorized(env)
+        else:
+            self.run_episodes(env, is_train, render)
 
-        for episode in range(self.max_iter):
+        if is_train:
+            self.save_checkpoint()
+            self.checkpoint_writer.close()
+            self.metrics.close()
+            self.metrics_writer.close()
+            self.timers.report()
+            if self.plotter is not None:
+                stop_plotter(self.plotter)
+
+        # the learner first, it may be waiting on a batch from the prefetcher
+        if is_train and self.learner is not None:
+            self.learner.close()
+        if is_train and self.prefetcher is not None:
+            self.prefetcher.close()
+
+    def run_episodes(self, env, is_train, render):
+        n_step_buffer = NStepBuffer(self.n_step, self.discount_factor_g) if is_train and self.n_step > 1 else None
+
+        for episode in range(self.start_episode if is_train else 0, self.max_iter):
+            # env outputs stay as they come (numpy arrays, plain numbers), the replay memory copies them into its
+            # arrays and only the observation the network looks at is copied into a preallocated input tensor
             state, _ = env.reset()
-            # convert anything going into the network to a tensor
-            state = torch.tensor(state, dtype=torch.float, device=self.device).to(self.device)
+            if n_step_buffer is not None:
+                n_step_buffer.reset()
 
             episode_reward = 0.0
+            episode_length = 0
             done = False
             while not done and episode_reward < self.stop_on_reward:
                 # Picking an action
-                if is_train and random.random() < epsilon:
-                    # random action
-                    action = env.action_space.sample()
-                    action = torch.tensor(action, dtype=torch.int64, device=self.device)
-                else:
-                    with torch.no_grad():
+                with self.act_timer:
+                    if is_train and random.random() < self.epsilon:
+                        # random action
+                        action = env.action_space.sample()
+                    else:
                         # action with best Q value
-                        action = policy_net(state.unsqueeze(dim=0)).squeeze().argmax()
+                        action = self.greedy_action(state)
 
                 # Processing
-                new_state, reward, done, truncated, info = env.step(action.item())
+                with self.env_step_timer:
+                    new_state, reward, done, truncated, info = env.step(action)
 
                 # accumulate reward
                 episode_reward += reward
-
-                # convert new state and reward to tensors on device
-                new_state = torch.tensor(new_state, dtype=torch.float, device=self.device)
-                reward = torch.tensor(reward, dtype=torch.float, device=self.device)
+                episode_length += 1
 
                 if is_train:
-                    memory.append((state, action, new_state, reward, done))
+                    with self.replay_append_timer:
+                        if n_step_buffer is None:
+                            self.replay.append((state, action, new_state, reward, done))
+                        else:
+                            for transition in n_step_buffer.append((state, action, new_state, reward, done)):
+                                self.replay.append(transition)
 
-                    step_count += 1
+                    self.after_env_steps(1)
 
                 state = new_state
 
                 if render:
                     env.render()
-            if is_train and not self.no_graph:
-                rewards_per_episode.append(episode_reward)
 
-            # Save model when new best reward is obtained.
             if is_train:
-                last_n_reward_avg = episode_reward if self.no_graph or self.rewards_to_average < 2 else np.mean(rewards_per_episode[-self.rewards_to_average:])
-                if last_n_reward_avg > best_reward:
-                    log_message = (f"{datetime.now().strftime(DATE_FORMAT)}: New best avg reward {last_n_reward_avg:0.1f}"
-                                   f" ({(last_n_reward_avg - best_reward) / best_reward * 100:+.1f}%) at episode {episode}, saving model...")
-                    print(log_message)
-                    with open(self.LOG_FILE, 'a') as file:
-                        file.write(log_message + '\n')
-
-                    torch.save(policy_net.state_dict(), self.MODEL_FILE)
-                    best_reward = last_n_reward_avg
-
-                # Update graph every x seconds
-                current_time = datetime.now()
-                if not self.no_graph and current_time - last_graph_update_time > timedelta(seconds=10):
-                    self.save_graph(rewards_per_episode, epsilon_history)
-                    last_graph_update_time = current_time
-
-                # If enough experience has been collected
-                if len(memory) > self.mini_batch_size:
-                    mini_batch = memory.sample(self.mini_batch_size)
-                    self.optimize(mini_batch, policy_net, target_net)
-
-                    # Decay epsilon
-                    # in this implementation we're using a geometric decay for epsilon (taking the product of epsilon_decay and current epsilon)
-                    # a linear decay is another option, decreasing epsilon by a fixed amount each episode (adjust epsilon_decay hyperparameter accordingly)
-                    epsilon = max(epsilon * self.epsilon_decay, self.epsilon_min)
-                    if not self.no_graph:
-                        epsilon_history.append(epsilon)
-
-                    # Copy policy network to target network after a certain number of steps
-                    if step_count > self.network_sync_rate:
-                        target_net.load_state_dict(policy_net.state_dict())
-                        step_count = 0
-
-    def save_graph(self, rewards_per_episode, epsilon_history):
-        # Save plots
-        fig = plt.figure(1)
-
-        # Plot average rewards (Y-axis) vs episodes (X-axis)
-        mean_rewards = np.zeros(len(rewards_per_episode))
-        for x in range(len(mean_rewards)):
-            mean_rewards[x] = np.mean(rewards_per_episode[max(0, x - 99):(x + 1)])
-        plt.subplot(121)  # plot on a 1 row x 2 col grid, at cell 1
-        # plt.xlabel('Episodes')
-        plt.ylabel('Mean Rewards')
-        plt.plot(mean_rewards)
-
-        # Plot epsilon decay (Y-axis) vs episodes (X-axis)
-        plt.subplot(122)  # plot on a 1 row x 2 col grid, at cell 2
-        # plt.xlabel('Time Steps')
-        plt.ylabel('Epsilon Decay')
-        plt.plot(epsilon_history)
-
-        plt.subplots_adjust(wspace=1.0, hspace=1.0)
-
-        # Save plots
-        fig.savefig(self.GRAPH_FILE)
-        plt.close(fig)
-
-    def optimize(self, mini_batch, policy_net, target_net):
+                self.finish_episode(episode, episode_reward, episode_length)
+
+    def run_vectorized(self, envs):
+        num_envs = envs.num_envs
+        n_step_buffers = None
+        if self.n_step > 1:
+            n_step_buffers = [NStepBuffer(self.n_step, self.discount_factor_g) for _ in range(num_envs)]
+
+        states, _ = envs.reset()
+        episode_rewards = np.zeros(num_envs)
+        episode_lengths = np.zeros(num_envs, dtype=np.int64)
+        # a sub-env whose episode ended gets reset by the following step(), which doesn't produce a transition
+        autoreset = np.zeros(num_envs, dtype=bool)
+
+        episode = self.start_episode
+        while episode < self.max_iter:
+            # pick actions for all sub-envs with one forward pass
+            with self.act_timer, torch.inference_mode():
+                with self.to_tensor_timer:
+                    states_input = torch.as_tensor(states, dtype=torch.float, device=self.device)
+                actions = self.acting_net(states_input).argmax(dim=1).cpu().numpy()
+                explore = np.random.random(num_envs) < self.epsilon
+                actions = np.where(explore, envs.action_space.sample(), actions)
+
+            with self.env_step_timer:
+                new_states, rewards, terminated, truncated, _ = envs.step(actions)
+
+            valid = ~autoreset
+            episode_rewards += np.where(valid, rewards, 0.0)
+            episode_lengths += valid
+            if valid.any():
+                batch = (states[valid], actions[valid], new_states[valid], rewards[valid], terminated[valid])
+                with self.replay_append_timer:
+                    if n_step_buffers is None:
+                        self.replay.append_batch(batch)
+                    else:
+                        ready = []
+                        for i, transition in zip(np.flatnonzero(valid), zip(*batch)):
+                            ready.extend(n_step_buffers[i].append(transition))
+                        if ready:
+                            self.replay.append_batch(tuple(np.array(field) for field in zip(*ready)))
+                self.after_env_steps(int(valid.sum()))
+
+            # episodes that reach stop_on_reward are cut short, same as in the single env loop
+            cut = valid & ~(terminated | truncated) & (episode_rewards >= self.stop_on_reward)
+            for i in np.flatnonzero(valid & (terminated | truncated | cut)):
+                # several sub-envs can finish on the same step, the ones past max_iter aren't counted
+                if episode < self.max_iter:
+                    self.finish_episode(episode, episode_rewards[i], int(episode_lengths[i]))
+                    episode += 1
+                episode_rewards[i] = 0.0
+                episode_lengths[i] = 0
+                if n_step_buffers is not None:
+                    n_step_buffers[i].reset()
+            if cut.any():
+                new_states, _ = envs.reset(options={'reset_mask': cut})
+
+            autoreset = terminated | truncated
+            states = new_states
+
+    def run_distributed(self, num_states, num_actions):
+        # this process is the learner: it fills the replay memory from the actors' channels and trains on the usual
+        # train_freq / end of episode cadence, the actors act with the latest broadcast weights
+        actor_config = dict(env_id=self.env_id, env_make_params=self.env_make_params, num_states=num_states,
+                            num_actions=num_actions, fc1_nodes=self.fc1_nodes, n_step=self.n_step,
+                            discount=self.discount_factor_g, stop_on_reward=self.stop_on_reward, seed=self.seed,
+                            num_threads=self.actor_threads or 1)
+        epsilons = actor_epsilons(self.num_actors, self.actor_epsilon, self.actor_epsilon_alpha)
+        self.log(f"Starting {self.num_actors} actors, epsilons {', '.join(f'{e:.3g}' for e in epsilons)}")
+
+        pool = ActorPool(actor_config, epsilons, (num_states,), self.actor_channel_size, self.policy_net)
+        try:
+            pool.broadcast(self.policy_net)
+            # from here on learn() broadcasts every weight_broadcast_interval updates, one drain can schedule
+            # thousands of them
+            self.last_broadcast = self.total_updates
+            with self.policy_lock:
+                self.actor_pool = pool
+            episode = self.start_episode
+            while episode < self.max_iter:
+                received = 0
+                with self.replay_append_timer:
+                    for batch in pool.drain():
+                        self.replay.append_batch(batch)
+                        received += len(batch[1])
+                if received:
+                    self.after_env_steps(received)
+
+                for actor_id, episode_reward, episode_length in pool.finished_episodes():
+                    if episode < self.max_iter:
+                        self.finish_episode(episode, episode_reward, episode_length)
+                        episode += 1
+
+                # every round, the others keep sending while one of them is dead
+                pool.check_actors()
+                if not received:
+                    time.sleep(0.001)  # nothing came in, don't spin
+        finally:
+            with self.policy_lock:  # the async learner may be broadcasting
+                self.actor_pool = None
+            pool.close()
+
+    def create_timers(self):
+        # one timer per phase of the loop, all the same no-op context manager unless timing is on
+        self.timers = PhaseTimers(self.timing_report_interval, log=self.log) if self.timing else NullTimers()
+        self.act_timer = self.timers.phase('act')  # picking actions, includes to_tensor and the forward pass
+        self.to_tensor_timer = self.timers.phase('to_tensor')
+        self.env_step_timer = self.timers.phase('env_step')
+        self.replay_append_timer = self.timers.phase('replay_append')  # drain + append in distributed mode
+        self.sample_timer = self.timers.phase('sample')  # includes priority updates for prioritized replay
+        self.forward_timer = self.timers.phase('forward')
+        self.backward_timer = self.timers.phase('backward')
+        self.optimizer_step_timer = self.timers.phase('optimizer_step')
+        self.target_sync_timer = self.timers.phase('target_sync')
+        self.sync_actor_timer = self.timers.phase('sync_actor')  # waiting on the async learner
+        self.model_save_timer = self.timers.phase('model_save')
+        self.checkpoint_timer = self.timers.phase('checkpoint')
+        # the graph itself is drawn by plotter.py in its own process, this is handing it the metrics
+        self.metrics_timer = self.timers.phase('metrics')
+
+    def create_acting_buffers(self, num_states):
+        # the policy's input for a single observation, filled in place every step through a numpy view
+        self.obs_host = torch.zeros((1, num_states), dtype=torch.float, pin_memory=self.device.type == 'cuda')
+        self.obs_host_view = self.obs_host.numpy()
+        self.obs_input = self.obs_host if self.device.type == 'cpu' else torch.zeros_like(self.obs_host,
+                                                                                          device=self.device)
+
+    def greedy_action(self, state):
+        with self.to_tensor_timer:
+            self.obs_host_view[0] = state
+            if self.obs_input is not self.obs_host:
+                self.obs_input.copy_(self.obs_host, non_blocking=True)
+        with torch.inference_mode():
+            return int(self.acting_net(self.obs_input).argmax())
+
+    def finish_episode(self, episode, episode_reward, episode_length):
+        mean_reward, last_n_reward_avg = self.history.add_episode(episode_reward)
+        self.metrics.append(episode, episode_reward, mean_reward, self.epsilon)
+
+        # env steps per second (across all envs / actors) over the last full STEPS_PER_SEC_WINDOW seconds, episodes
+        # often end together (vector envs, actors' results) so the time between two of them says nothing. Until the
+        # first window is full it's the rate so far
+        now = time.perf_counter()
+        window_time, window_steps = self.rate_window_start
+        rate_so_far = (self.total_steps - window_steps) / max(now - window_time, 1e-9)
+        if now - window_time >= STEPS_PER_SEC_WINDOW:
+            self.steps_per_sec = rate_so_far
+            self.rate_window_start = (now, self.total_steps)
+        steps_per_sec = rate_so_far if self.steps_per_sec is None else self.steps_per_sec
+        self.episode_metrics.append(episode, episode_reward, episode_length, self.epsilon, self.total_steps,
+                                    steps_per_sec, time.time())
+        with self.metrics_timer:
+            self.metrics_writer.maybe_flush()
+
+        # Save model when new best reward is obtained.
+        if last_n_reward_avg > self.best_reward:
+            self.log(f"New best avg reward {last_n_reward_avg:0.1f}"
+                     f" ({(last_n_reward_avg - self.best_reward) / self.best_reward * 100:+.1f}%) at episode {episode}, saving model...")
+
+            with self.model_save_timer:
+                with self.policy_lock:
+                    self.checkpoint_writer.save(self.policy_net.state_dict(), self.MODEL_FILE)
+                if isinstance(self.memory, MmapReplayMemory):
+                    self.memory.flush()  # keep the on-disk replay in step with the saved model
+            self.best_reward = last_n_reward_avg
+
+        # Hand the latest metrics to the plotter every x seconds
+        current_time = datetime.now()
+        if current_time - self.last_metrics_flush_time > timedelta(seconds=METRICS_FLUSH_INTERVAL):
+            with self.metrics_timer:
+                self.metrics.flush()
+            self.last_metrics_flush_time = current_time
+
+        if current_time - self.last_replay_log_time > timedelta(seconds=self.replay_log_interval):
+            self.log_replay_size(self.memory)
+            self.last_replay_log_time = current_time
+
+        # If enough experience has been collected
+        if self.learning_started():
+            if self.train_freq is None:
+                self.schedule_updates(1)
+
+            # Decay epsilon (the actors' epsilons are fixed in distributed mode, so this one is just for the graph)
+            # in this implementation we're using a geometric decay for epsilon (taking the product of epsilon_decay and current epsilon)
+            # a linear decay is another option, decreasing epsilon by a fixed amount each episode (adjust epsilon_decay hyperparameter accordingly)
+            self.epsilon = max(self.epsilon * self.epsilon_decay, self.epsilon_min)
+
+        # checkpoints are only taken between episodes, a resumed run starts with the next one
+        self.start_episode = episode + 1
+        if current_time - self.last_checkpoint_time > timedelta(seconds=self.checkpoint_interval):
+            self.save_checkpoint()
+            self.last_checkpoint_time = current_time
+        self.timers.maybe_report()
+
+    def after_env_steps(self, count):
+        self.step_count += count
+        self.total_steps += count
+
+        # run gradient_steps updates for every train_freq env steps, independent of episode boundaries
+        if self.train_freq is not None and self.learning_started():
+            self.steps_since_train += count
+            if self.steps_since_train >= self.train_freq:
+                updates = self.gradient_steps * (self.steps_since_train // self.train_freq)
+                self.steps_since_train %= self.train_freq
+                self.schedule_updates(updates)
+
+        # the target network follows the policy network on its own env step cadence, with the async learner it's
+        # updated on the learner thread once the updates scheduled so far are done. Steps come in batches (vector
+        # envs, the actors' channels), all the updates they make due are folded into one
+        if self.step_count >= self.target_update_interval:
+            due = self.step_count // self.target_update_interval
+            self.step_count %= self.target_update_interval
+            if self.learner is None:
+                self.update_target(due)
+            else:
+                self.learner.schedule_target_update(due)
+
+        if self.learner is not None:
+            with self.sync_actor_timer:
+                self.learner.sync_actor()
+
+    def schedule_updates(self, updates):
+        if self.learner is None:
+            for _ in range(updates):
+                self.learn()
+        else:
+            self.learner.schedule(updates)
+
+    def learning_started(self):
+        return len(self.memory) > self.mini_batch_size and self.total_steps >= self.learning_starts
+
+    def update_target(self, count=1):  # count > 1 folds that many target updates with no learning in between
+        with self.target_sync_timer:
+            if self.target_update_tau is None:
+                # Copy policy network to target network, nothing to copy if it hasn't been updated since the last sync
+                if self.updates_since_sync > 0:
+                    self.target_net.load_state_dict(self.policy_net.state_dict())
+            else:
+                # target = target + tau * (policy - target), for all parameters with one fused in-place op
+                # count steps towards the same policy weights are a single step with tau' = 1 - (1 - tau)^count
+                tau = 1 - (1 - self.target_update_tau) ** count
+                with torch.no_grad():
+                    torch._foreach_lerp_(self.target_params, self.policy_params, tau)
+            self.updates_since_sync = 0
+
+    def learn(self):
+        self.updates_since_sync += 1
+        self.total_updates += 1
+        if isinstance(self.memory, PrioritizedReplayMemory):
+            with self.sample_timer:
+                mini_batch, weights, indices = self.replay.sample(self.mini_batch_size)
+            td_errors, loss, q_mean = self.optimize(mini_batch, weights)
+            with self.sample_timer:
+                self.replay.update_priorities(indices, td_errors)
+        else:
+            with self.sample_timer:
+                mini_batch = self.replay.sample(self.mini_batch_size)
+            td_errors, loss, q_mean = self.optimize(mini_batch)
+        # still tensors, turned into numbers a whole chunk at a time when the metrics are written
+        self.update_metrics.append(self.total_updates, loss, q_mean)
+
+        if self.actor_pool is not None and self.total_updates - self.last_broadcast >= self.weight_broadcast_interval:
+            with self.policy_lock:
+                # a broadcast is skipped while an actor still reads the slot it would overwrite, retried next update
+                if self.actor_pool is not None and self.actor_pool.broadcast(self.policy_net):
+                    self.last_broadcast = self.total_updates
+
+    def save_checkpoint(self):
+        with self.checkpoint_timer:
+            self._save_checkpoint()
+
+    def _save_checkpoint(self):
+        # everything needed to carry on training: networks, optimizer, schedule state, history and RNG states,
+        # plus a snapshot of the replay memory
+        os.makedirs(self.CHECKPOINT_DIR, exist_ok=True)
+        if self.checkpoint_replay:
+            if isinstance(self.memory, MmapReplayMemory):
+                self.memory.flush()  # already on disk, reopened in place on resume
+            else:
+                self.replay.save(os.path.join(self.CHECKPOINT_DIR, 'replay'))
+
+        with self.policy_lock:
+            checkpoint = {
+                'policy_net': self.policy_net.state_dict(),
+                'target_net': self.target_net.state_dict(),
+                'optimizer': self.optimizer.state_dict(),
+                'epsilon': self.epsilon,
+                'step_count': self.step_count,
+                'updates_since_sync': self.updates_since_sync,
+                'total_updates': self.total_updates,
+                'total_steps': self.total_steps,
+                'steps_since_train': self.steps_since_train,
+                'episode': self.start_episode,
+                'best_reward': self.best_reward,
+                'history': self.history.state_dict(),
+                'python_rng': random.getstate(),
+                'numpy_rng': np.random.get_state(),
+                'torch_rng': torch.get_rng_state(),
+                'cuda_rng': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            }
+            # cloned here, written next to the old one and swapped in on the writer's thread
+            self.checkpoint_writer.save(checkpoint, os.path.join(self.CHECKPOINT_DIR, 'state.pt'))
+        self.log(f"Saving checkpoint at episode {self.start_episode}, {self.total_steps} env steps")
+
+    def load_checkpoint(self):
+        path = os.path.join(self.CHECKPOINT_DIR, 'state.pt')
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No checkpoint to resume from at {path}")
+        checkpoint = torch.load(path, map_location=self.device, weights_only=False)
+
+        self.policy_net.load_state_dict(checkpoint['policy_net'])
+        self.target_net.load_state_dict(checkpoint['target_net'])
+        self.optimizer.load_state_dict(checkpoint['optimizer'])
+        self.epsilon = checkpoint['epsilon']
+        self.step_count = checkpoint['step_count']
+        self.updates_since_sync = checkpoint['updates_since_sync']
+        self.total_updates = checkpoint['total_updates']
+        self.total_steps = checkpoint['total_steps']
+        self.steps_since_train = checkpoint['steps_since_train']
+        self.start_episode = checkpoint['episode']
+        self.best_reward = checkpoint['best_reward']
+        self.history.load_state_dict(checkpoint['history'])
+        random.setstate(checkpoint['python_rng'])
+        np.random.set_state(checkpoint['numpy_rng'])
+        torch.set_rng_state(checkpoint['torch_rng'])
+        if checkpoint['cuda_rng'] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(checkpoint['cuda_rng'])
+
+        replay_dir = os.path.join(self.CHECKPOINT_DIR, 'replay')
+        if self.checkpoint_replay and not isinstance(self.memory, MmapReplayMemory) and os.path.exists(replay_dir):
+            self.memory.load(replay_dir)
+        self.log(f"Resumed from checkpoint at episode {self.start_episode}, {self.total_steps} env steps,"
+                 f" epsilon {self.epsilon:0.4f}, {len(self.memory)} transitions in replay")
+
+    def log(self, message):
+        log_message = f"{datetime.now().strftime(DATE_FORMAT)}: {message}"
+        print(log_message)
+        with open(self.LOG_FILE, 'a') as file:
+            file.write(log_message + '\n')
+
+    def create_memory(self, observation_space, resume=False):
+        memory_types = {'deque': ReplayMemory, 'array': ArrayReplayMemory, 'mmap': MmapReplayMemory,
+                        'episodic': EpisodicReplayMemory, 'prioritized': PrioritizedReplayMemory}
+        if self.replay_memory_type not in memory_types:
+            raise ValueError(f"Unknown replay_memory_type '{self.replay_memory_type}'")
+        memory_class = memory_types[self.replay_memory_type]
+        state_shape = observation_space.shape
+        if self.replay_obs_dtype == 'auto':
+            state_dtype = compact_observation_dtype(observation_space)
+        else:
+            state_dtype = np.dtype(self.replay_obs_dtype)
+
+        capacity = self.replay_memory_size
+        if self.replay_memory_bytes is not None:
+            capacity = memory_class.capacity_for_bytes(self.replay_memory_bytes, state_shape, state_dtype)
+
+        if memory_class is ReplayMemory:
+            return ReplayMemory(capacity=capacity, seed=self.seed, device=self.device, state_shape=state_shape)
+        if memory_class is MmapReplayMemory:
+            # the files from the last run are only picked up again when resuming it
+            return MmapReplayMemory(capacity=capacity, state_shape=state_shape, directory=self.REPLAY_DIR,
+                                    device=self.device, seed=self.seed, state_dtype=state_dtype, reopen=resume)
+        if memory_class is PrioritizedReplayMemory:
+            return PrioritizedReplayMemory(capacity=capacity, state_shape=state_shape, device=self.device,
+                                           seed=self.seed, state_dtype=state_dtype, alpha=self.priority_alpha,
+                                           beta=self.priority_beta, beta_increment=self.priority_beta_increment)
+        return memory_class(capacity=capacity, state_shape=state_shape, device=self.device, seed=self.seed,
+                            state_dtype=state_dtype)
+
+    def log_replay_size(self, memory):
+        # the buffer's arrays are allocated up front but only take memory as pages get written (or, for mmap, paged
+        # in), so the process's resident size is logged next to what the buffer has allocated
+        rss = resident_set_bytes()
+        self.log(f"Replay memory ({self.replay_memory_type}) holds {len(memory)}/{memory.capacity} transitions,"
+                 f" {memory.nbytes / 2 ** 20:0.1f} MiB allocated"
+                 + (f", process resident size {rss / 2 ** 20:0.1f} MiB" if rss is not None else ""))
+
+    def create_td_loss(self, num_states):
+        # with n-step returns the bootstrapped value sits n steps ahead, so it is discounted by gamma^n
+        td_loss = TDLoss(self.policy_net, self.target_net, self.discount_factor_g ** self.n_step,
+                         self.enable_double_dqn)
+        if not self.compile_optimize:
+            return td_loss
+        if self.compile_optimize != 'torchscript':
+            compiled = torch.compile(td_loss)
+            try:
+                # torch.compile is lazy, run it once on a dummy batch so a missing compiler toolchain shows up here
+                batch_size = self.mini_batch_size
+                compiled(torch.zeros((batch_size, num_states), device=self.device),
+                         torch.zeros(batch_size, dtype=torch.int64, device=self.device),
+                         torch.zeros((batch_size, num_states), device=self.device),
+                         torch.zeros(batch_size, device=self.device), torch.zeros(batch_size, device=self.device))
+                return compiled
+            except Exception as e:
+                self.log(f"torch.compile failed ({type(e).__name__}: {e}), falling back to TorchScript")
+        return torch.jit.script(td_loss)
+
+    def optimize(self, mini_batch, weights=None):
         # slow but easy to understand version
         # for state, action, new_state, reward, done in mini_batch:
         #     if done:
@@ -217,41 +713,28 @@ class Agent:
 
         #     current_q = policy_net(state)
 
-        #     loss = self.loss_fn(current_q, target_q)
+        #     loss = torch.nn.functional.mse_loss(current_q, target_q)
 
         #     self.optimizer.zero_grad() # clear the gradients
         #     loss.backward() # compute gradients (backpropagation)
         #     self.optimizer.step()
 
         # fast version
-        # transpose the batch of experiences
-        states, actions, new_states, rewards, dones = zip(*mini_batch)
-
-        # stack tensors to create batch tensors
-        states = torch.stack(states)
-        actions = torch.stack(actions)
-        new_states = torch.stack(new_states)
-        rewards = torch.stack(rewards)
-        dones = torch.tensor(dones).float().to(self.device)
-
-        with torch.no_grad():
-            if self.enable_double_dqn:
-                best_action_from_policy = policy_net(new_states).argmax(dim=1)
-                target_q = rewards + (1 - dones) * self.discount_factor_g * \
-                           target_net(new_states).gather(dim=1,
-                                                         index=best_action_from_policy.unsqueeze(dim=1)).squeeze()
-            else:
-                # calculate target q values (expected future rewards)
-                target_q = rewards + (1 - dones) * self.discount_factor_g * target_net(new_states).max(dim=1)[0]
-
-        # calculate the Q value from the current policy
-        current_q = policy_net(states).gather(dim=1, index=actions.unsqueeze(dim=1)).squeeze()
+        # the replay memory hands back the batch already stacked into tensors, TDLoss does the batched
+        # forward passes (see td_loss.py)
+        states, actions, new_states, rewards, dones = mini_batch
+        with self.forward_timer:
+            loss, td_errors, q_mean = self.td_loss(states, actions, new_states, rewards, dones, weights)
 
-        loss = self.loss_fn(current_q, target_q)
+        with self.backward_timer:
+            self.optimizer.zero_grad(set_to_none=True)  # clear the gradients
+            loss.backward()  # compute gradients (backpropagation)
+        with self.optimizer_step_timer, self.policy_lock:  # the only point the async learner changes the weights
+            self.optimizer.step()
 
-        self.optimizer.zero_grad()  # clear the gradients
-        loss.backward()  # compute gradients (backpropagation)
-        self.optimizer.step()
+        # td errors, used by prioritized replay to update the sampled transitions' priorities, plus the loss and
+        # mean Q value for the metrics
+        return td_errors, loss.detach(), q_mean
 
 
 if __name__ == '__main__':
@@ -259,11 +742,12 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Train or test model.')
     parser.add_argument('model', help='')
     parser.add_argument('--train', help='Training mode', action='store_true')
+    parser.add_argument('--resume', help='Continue training from the last checkpoint', action='store_true')
     args = parser.parse_args()
     
     dql = Agent(hyperparam_option=args.model)
 
     if args.train:
-        dql.run(is_train=True)
+        dql.run(is_train=True, resume=args.resume)
     else:
         dql.run(is_train=False, render=True)
@@ -0,0 +1,75 @@
+"""
+Microbenchmark for the acting path of Agent.run_episodes: env.step, action selection and the replay append,
+without any learning. Compares the previous per-step tensor path against the current one on CartPole-v1.
+
+    python benchmark_acting.py [hyperparameter option] [--steps N]
+"""
+import argparse
+from collections import deque
+import time
+
+import gymnasium as gym
+import torch
+
+from agent import Agent
+from dqn import DQN
+from replay_memory import ArrayReplayMemory
+
+
+def legacy_steps(agent, env, memory, steps):
+    # the acting loop as it was: new tensors for every state, action and reward, plus .item() on the action,
+    # appended to a deque like the replay memory of the time
+    state, _ = env.reset(seed=0)
+    state = torch.tensor(state, dtype=torch.float, device=agent.device).to(agent.device)
+    for _ in range(steps):
+        with torch.no_grad():
+            action = agent.policy_net(state.unsqueeze(dim=0)).squeeze().argmax()
+        new_state, reward, done, truncated, info = env.step(action.item())
+        new_state = torch.tensor(new_state, dtype=torch.float, device=agent.device)
+        reward = torch.tensor(reward, dtype=torch.float, device=agent.device)
+        memory.append((state, action, new_state, reward, done))
+        state = new_state
+        if done or truncated:
+            state, _ = env.reset()
+            state = torch.tensor(state, dtype=torch.float, device=agent.device).to(agent.device)
+
+
+def current_steps(agent, env, memory, steps):
+    state, _ = env.reset(seed=0)
+    for _ in range(steps):
+        action = agent.greedy_action(state)
+        new_state, reward, done, truncated, info = env.step(action)
+        memory.append((state, action, new_state, reward, done))
+        state = new_state
+        if done or truncated:
+            state, _ = env.reset()
+
+
+def measure(step_fn, agent, env, memory, steps):
+    step_fn(agent, env, memory, min(steps, 1000))  # warm up
+    start = time.perf_counter()
+    step_fn(agent, env, memory, steps)
+    return steps / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the acting path.')
+    parser.add_argument('model', nargs='?', default='cartpole1')
+    parser.add_argument('--steps', type=int, default=50000)
+    args = parser.parse_args()
+
+    agent = Agent(hyperparam_option=args.model)
+    env = gym.make(agent.env_id, **agent.env_make_params)
+    num_states = env.observation_space.shape[0]
+    agent.policy_net = DQN(num_states, env.action_space.n, agent.fc1_nodes).to(agent.device)
+    agent.acting_net = agent.policy_net
+    agent.create_acting_buffers(num_states)
+    agent.create_timers()
+
+    # each path with the storage it appends to: the tensor tuples went into a deque, the numpy outputs go into
+    # the preallocated arrays
+    before = measure(legacy_steps, agent, env, deque(maxlen=args.steps), args.steps)
+    after = measure(current_steps, agent, env, ArrayReplayMemory(args.steps, env.observation_space.shape), args.steps)
+    print(f"{agent.env_id} ({args.model}), {args.steps} steps, fc1_nodes={agent.fc1_nodes}, device={agent.device}")
+    print(f"before: {before:10.0f} steps/sec")
+    print(f"after:  {after:10.0f} steps/sec ({after / before:.2f}x)")
@@ -0,0 +1,98 @@
+"""
+Microbenchmark for the learner step of Agent.optimize: loss, backward and optimizer step on random mini batches,
+without any env or replay memory. Compares the previous three forward pass step against TDLoss run eagerly,
+through torch.compile and through TorchScript.
+
+    python benchmark_learner.py [hyperparameter option ...] [--updates N] [--rounds N]
+"""
+import argparse
+import time
+
+import gymnasium as gym
+import torch
+import flappy_bird_gymnasium  # registers the FlappyBird env
+
+from agent import Agent
+from dqn import DQN
+
+
+legacy_loss_fn = torch.nn.MSELoss()  # what Agent used before TDLoss
+
+
+def legacy_step(agent, mini_batch):
+    # the update as it was: separate policy passes for the next action and the current Q values, plus nn.MSELoss
+    states, actions, new_states, rewards, dones = mini_batch
+    discount = agent.discount_factor_g ** agent.n_step
+    with torch.no_grad():
+        if agent.enable_double_dqn:
+            best_action_from_policy = agent.policy_net(new_states).argmax(dim=1)
+            target_q = rewards + (1 - dones) * discount * \
+                       agent.target_net(new_states).gather(dim=1, index=best_action_from_policy.unsqueeze(dim=1)).squeeze()
+        else:
+            target_q = rewards + (1 - dones) * discount * agent.target_net(new_states).max(dim=1)[0]
+    current_q = agent.policy_net(states).gather(dim=1, index=actions.unsqueeze(dim=1)).squeeze()
+    loss = legacy_loss_fn(current_q, target_q)
+    agent.optimizer.zero_grad()
+    loss.backward()
+    agent.optimizer.step()
+
+
+def current_step(agent, mini_batch):
+    agent.optimize(mini_batch)
+
+
+def measure(step_fn, agent, mini_batch, updates, rounds):
+    for _ in range(min(updates, 50)):  # warm up (and let torch.compile do its thing)
+        step_fn(agent, mini_batch)
+    # best of a few rounds, a single CPU timing of ~1ms steps is at the mercy of whatever else the machine is doing
+    best = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(updates):
+            step_fn(agent, mini_batch)
+        best = max(best, updates / (time.perf_counter() - start))
+    return best
+
+
+def setup(option, compile_optimize):
+    agent = Agent(hyperparam_option=option)
+    agent.hyperparams['compile_optimize'] = agent.compile_optimize = compile_optimize
+    env = gym.make(agent.env_id, **agent.env_make_params)
+    num_states = env.observation_space.shape[0]
+    num_actions = int(env.action_space.n)
+    env.close()
+
+    agent.policy_net = DQN(num_states, num_actions, agent.fc1_nodes).to(agent.device)
+    agent.target_net = DQN(num_states, num_actions, agent.fc1_nodes).to(agent.device)
+    agent.target_net.load_state_dict(agent.policy_net.state_dict())
+    agent.target_net.requires_grad_(False)
+    agent.optimizer = torch.optim.Adam(agent.policy_net.parameters(), lr=agent.learning_rate_a)
+    agent.td_loss = agent.create_td_loss(num_states)
+    agent.create_timers()
+
+    batch_size = agent.mini_batch_size
+    mini_batch = (torch.randn((batch_size, num_states), device=agent.device),
+                  torch.randint(num_actions, (batch_size,), device=agent.device),
+                  torch.randn((batch_size, num_states), device=agent.device),
+                  torch.randn(batch_size, device=agent.device),
+                  (torch.rand(batch_size, device=agent.device) < 0.05).float())
+    return agent, mini_batch
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the learner step.')
+    parser.add_argument('models', nargs='*', default=['flappybird1', 'flappybird5', 'flappybird8'])
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    for option in args.models:
+        agent, mini_batch = setup(option, False)
+        print(f"{agent.env_id} ({option}), batch={agent.mini_batch_size}, fc1_nodes={agent.fc1_nodes}, "
+              f"double_dqn={agent.enable_double_dqn}, device={agent.device}")
+        legacy = measure(legacy_step, agent, mini_batch, args.updates, args.rounds)
+        print(f"  legacy:      {legacy:8.0f} updates/sec")
+        for name, compile_optimize in (('eager', False), ('compile', 'compile'), ('torchscript', 'torchscript')):
+            agent, mini_batch = setup(option, compile_optimize)
+            updates_per_sec = measure(current_step, agent, mini_batch, args.updates, args.rounds)
+            print(f"  {name + ':':12s} {updates_per_sec:8.0f} updates/sec ({updates_per_sec / legacy:.2f}x)")
@@ -0,0 +1,79 @@
+import os
+import threading
+
+import torch
+
+
+def _clone(obj):
+    # tensors are cloned (on their own device, the worker does the slow part), containers are copied so the caller
+    # can keep changing them
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().clone()
+    if isinstance(obj, dict):
+        return type(obj)((key, _clone(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_clone(value) for value in obj)
+    return obj
+
+
+class CheckpointWriter:
+    """
+    Writes torch.save files on a background thread so saving doesn't hold up training.
+
+    save() only takes a snapshot of the object (tensors cloned, containers copied) and queues it. The worker
+    serializes to a temp file next to the target and swaps it in with os.replace, so anyone reading the file sees
+    either the previous version or the new one, never half of it. Saves to a path that is still queued replace the
+    queued one, so when saves come faster than the disk only the latest gets written.
+    """
+
+    def __init__(self):
+        self.pending = {}  # path -> latest snapshot waiting to be written
+        self.writing = False
+        self.error = None
+        self.stopping = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                path, obj = self.pending.popitem()
+                self.writing = True
+            try:
+                torch.save(obj, path + '.tmp')
+                os.replace(path + '.tmp', path)
+            except Exception as e:
+                self.error = e
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Background checkpoint write failed") from error
+
+    def save(self, obj, path):
+        self._check_error()
+        snapshot = _clone(obj)
+        with self.condition:
+            self.pending[path] = snapshot
+            self.condition.notify_all()
+
+    def flush(self):  # blocks until everything queued so far is on disk
+        with self.condition:
+            while self.pending or self.writing:
+                self.condition.wait()
+        self._check_error()
+
+    def close(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join()
+        self._check_error()
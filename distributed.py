@@ -0,0 +1,238 @@
+import multiprocessing as mp
+import queue
+import random
+import time
+from multiprocessing import shared_memory
+
+import gymnasium as gym
+import numpy as np
+import torch
+
+from dqn import DQN
+from n_step import NStepBuffer
+from shared_weights import SharedWeights
+
+# actor processes are spawned fresh, they need the custom envs registered too
+import flappy_bird_gymnasium
+import gym_games
+
+ACTOR_POLL_STEPS = 100  # env steps between an actor checking for new weights and for shutdown
+
+
+def actor_epsilons(num_actors, epsilon, alpha):
+    # Ape-X style spread of fixed exploration rates: epsilon^(1 + alpha * i / (N - 1)) for actor i
+    if num_actors == 1:
+        return [epsilon]
+    return [epsilon ** (1 + alpha * i / (num_actors - 1)) for i in range(num_actors)]
+
+
+class TransitionChannel:
+    """
+    Ring buffer of transitions in shared memory, written by one actor process and read by the learner.
+
+    The actor fills a slot and then publishes it by bumping the write count, the learner copies everything between its
+    read count and the write count out in one go and hands the slots back by bumping the read count. Counts only grow,
+    slot i lives at i % capacity. When the ring is full the actor waits for the learner.
+    """
+
+    def __init__(self, capacity, state_shape, ctx):
+        self.capacity = capacity
+        self.state_shape = tuple(state_shape)
+        state_bytes = capacity * int(np.prod(self.state_shape)) * 4
+        self.shm = shared_memory.SharedMemory(create=True, size=2 * state_bytes + capacity * (8 + 4 + 1))
+        self.owner = True
+        self.write_count = ctx.Value('q', 0)
+        self.read_count = ctx.Value('q', 0)
+        self._attach()
+
+    def _attach(self):
+        # the five transition fields laid out one after the other in the shared block
+        fields = [('states', np.float32, self.state_shape), ('actions', np.int64, ()),
+                  ('new_states', np.float32, self.state_shape), ('rewards', np.float32, ()), ('dones', np.bool_, ())]
+        offset = 0
+        for name, dtype, shape in fields:
+            array = np.ndarray((self.capacity, *shape), dtype=dtype, buffer=self.shm.buf, offset=offset)
+            setattr(self, name, array)
+            offset += array.nbytes
+        self.written = self.write_count.value
+        self.read = self.read_count.value
+
+    def __getstate__(self):
+        # sent to the actor process: the block is reattached by name rather than copied
+        return {'capacity': self.capacity, 'state_shape': self.state_shape, 'shm_name': self.shm.name,
+                'write_count': self.write_count, 'read_count': self.read_count}
+
+    def __setstate__(self, state):
+        self.capacity = state['capacity']
+        self.state_shape = state['state_shape']
+        self.shm = shared_memory.SharedMemory(name=state['shm_name'])
+        self.owner = False
+        self.write_count = state['write_count']
+        self.read_count = state['read_count']
+        self._attach()
+
+    def put(self, transition, stop_event):
+        while self.written - self.read_count.value >= self.capacity:
+            if stop_event.is_set():
+                return
+            time.sleep(0.001)
+        state, action, new_state, reward, done = transition
+        i = self.written % self.capacity
+        self.states[i] = state
+        self.actions[i] = action
+        self.new_states[i] = new_state
+        self.rewards[i] = reward
+        self.dones[i] = done
+        self.written += 1
+        self.write_count.value = self.written  # Value's lock doubles as the barrier publishing the slot
+
+    def get_all(self):  # returns a batch of everything written since the last call, or None
+        written = self.write_count.value
+        if written == self.read:
+            return None
+        slots = np.arange(self.read, written) % self.capacity
+        # fancy indexing copies, so the slots can be handed back right away
+        batch = (self.states[slots], self.actions[slots], self.new_states[slots], self.rewards[slots],
+                 self.dones[slots])
+        self.read = written
+        self.read_count.value = written
+        return batch
+
+    def close(self):
+        # drop the numpy views first, SharedMemory refuses to close while they still point into the block
+        self.states = self.actions = self.new_states = self.rewards = self.dones = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def run_actor(actor_id, config, channel, weights, results, stop_event):
+    torch.set_num_threads(config['num_threads'])
+    seed = None if config['seed'] is None else config['seed'] + actor_id
+    rng = random.Random(seed)
+    if seed is not None:
+        torch.manual_seed(seed)
+
+    env = gym.make(config['env_id'], **config['env_make_params'])
+    env.action_space.seed(seed)
+    policy_net = DQN(config['num_states'], config['num_actions'], config['fc1_nodes'])
+    policy_net.requires_grad_(False)
+    weights.bind(policy_net, actor_id)  # the parameters are now views on the learner's published weights
+    obs_input = torch.zeros((1, config['num_states']))
+    obs_input_view = obs_input.numpy()
+
+    epsilon = config['epsilon']
+    n_step_buffer = NStepBuffer(config['n_step'], config['discount']) if config['n_step'] > 1 else None
+    steps = 0
+    episode = 0
+    while not stop_event.is_set():
+        state, _ = env.reset(seed=None if seed is None or episode > 0 else seed)
+        if n_step_buffer is not None:
+            n_step_buffer.reset()
+        episode_reward = 0.0
+        episode_length = 0
+        done = False
+        while not done and episode_reward < config['stop_on_reward']:
+            if rng.random() < epsilon:
+                action = env.action_space.sample()
+            else:
+                obs_input_view[0] = state
+                with torch.inference_mode():
+                    action = int(policy_net(obs_input).argmax())
+
+            new_state, reward, done, truncated, info = env.step(action)
+            episode_reward += reward
+            episode_length += 1
+
+            if n_step_buffer is None:
+                channel.put((state, action, new_state, reward, done), stop_event)
+            else:
+                for transition in n_step_buffer.append((state, action, new_state, reward, done)):
+                    channel.put(transition, stop_event)
+            state = new_state
+            done = done or truncated
+
+            steps += 1
+            if steps % ACTOR_POLL_STEPS == 0:
+                if stop_event.is_set():
+                    break
+                weights.refresh()
+        else:
+            # with how far the channel had been written, so the learner can tell when it has all of the episode
+            results.put((actor_id, episode_reward, episode_length, channel.written))
+        episode += 1
+
+    env.close()
+    channel.close()
+    weights.close()
+
+
+class ActorPool:
+    """
+    Actor processes for Ape-X style training: each runs its own env and CPU copy of the policy network with a fixed
+    epsilon and streams transitions to the learner through a TransitionChannel. The learner (the process that
+    creates the pool) drains the channels into its replay memory and now and then broadcasts new weights, which the
+    actors' networks read in place from a SharedWeights block.
+    Processes are started with 'spawn', so nothing but the arguments is shared with the learner.
+    """
+
+    def __init__(self, config, epsilons, state_shape, channel_size, policy_net):
+        ctx = mp.get_context('spawn')
+        self.stop_event = ctx.Event()
+        self.results = ctx.Queue()
+        self.reported = []  # finished episodes whose transitions haven't all been drained yet
+        self.channels = [TransitionChannel(channel_size, state_shape, ctx) for _ in epsilons]
+        self.weights = SharedWeights(policy_net, len(epsilons), ctx)
+        self.processes = []
+        for actor_id, epsilon in enumerate(epsilons):
+            process = ctx.Process(target=run_actor, name=f'actor-{actor_id}', daemon=True,
+                                  args=(actor_id, dict(config, epsilon=epsilon), self.channels[actor_id],
+                                        self.weights, self.results, self.stop_event))
+            process.start()
+            self.processes.append(process)
+
+    def broadcast(self, policy_net):  # returns False when it has to be retried later, see SharedWeights
+        return self.weights.publish(policy_net)
+
+    def drain(self):  # returns the transitions streamed in since the last call, one batch per actor that sent any
+        batches = []
+        for channel in self.channels:
+            batch = channel.get_all()
+            if batch is not None:
+                batches.append(batch)
+        return batches
+
+    def finished_episodes(self):  # returns (actor id, reward, length) for the episodes finished since the last call
+        # results and transitions come in separately, an episode only counts as finished once drain() has handed
+        # out all of its transitions
+        while True:
+            try:
+                self.reported.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        finished = []
+        waiting = []
+        for actor_id, reward, length, written in self.reported:
+            if self.channels[actor_id].read >= written:
+                finished.append((actor_id, reward, length))
+            else:
+                waiting.append((actor_id, reward, length, written))
+        self.reported = waiting
+        return finished
+
+    def check_actors(self):  # raises when an actor process has died, only polls their exit codes
+        for actor_id, process in enumerate(self.processes):
+            if process.exitcode is not None:
+                # a dead actor would hold on to its weight slot forever and block every later broadcast
+                self.weights.release(actor_id)
+                raise RuntimeError(f"Actor process {process.name} exited with code {process.exitcode}")
+
+    def close(self):
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        for channel in self.channels:
+            channel.close()
+        self.weights.close()
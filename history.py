@@ -0,0 +1,185 @@
+import numpy as np
+
+
+class RollingMean:
+    """
+    Mean of the last `window` values (fewer at the start), kept up to date in O(1) per value with a running sum over
+    a fixed-size ring of the values.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.values = np.zeros(window)
+        self.count = 0  # values seen so far, the ring position is count % window
+        self.total = 0.0
+
+    def append(self, value):  # returns the mean including the new value
+        i = self.count % self.window
+        if self.count >= self.window:
+            self.total -= self.values[i]
+        self.values[i] = value
+        self.total += value
+        self.count += 1
+        # adding and subtracting floats for millions of episodes drifts, so resum the window now and then
+        if self.count % self.window == 0:
+            self.total = float(self.values.sum())
+        return self.mean
+
+    @property
+    def mean(self):
+        return self.total / min(self.count, self.window)
+
+    def state_dict(self):
+        return {'values': self.values.copy(), 'count': self.count, 'total': self.total}
+
+    def load_state_dict(self, state):
+        self.values[:] = state['values']
+        self.count = state['count']
+        self.total = state['total']
+
+
+class SeriesArchive:
+    """
+    Bounded-size summary of an unbounded series, for plotting.
+
+    Keeps `levels` resolutions of `size` buckets each, with bucket i of level k summarizing factor^k consecutive
+    values by their start position, count, sum, min and max. All but the last level are rings holding the most
+    recent buckets, so level 0 is the last `size` values exactly and each coarser level reaches further back.
+    The last level covers the whole series: when it fills up, neighbouring buckets are merged pairwise and its
+    bucket size doubles. series() stitches the levels together, finest where available.
+    Values come in through extend() in batches of any size, whole buckets are reduced with numpy.
+    """
+
+    START, COUNT, TOTAL, LOW, HIGH = range(5)
+
+    def __init__(self, size=1000, levels=3, factor=32):
+        if size % 2:
+            raise ValueError(f"SeriesArchive size must be even, got {size}")
+        self.size = size
+        self.bucket_sizes = [factor ** level for level in range(levels)]
+        self.buckets = np.zeros((levels, size, 5))
+        self.filled = np.zeros(levels, dtype=np.int64)  # buckets completed per level (ever, for the rings)
+        self.partial = np.zeros((levels, 5))  # the bucket each level is filling at the moment
+        self.length = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        for level in range(len(self.bucket_sizes)):
+            self._extend_level(level, values)
+        self.length += len(values)
+
+    def _extend_level(self, level, values):
+        partial = self.partial[level]
+        last_level = level == len(self.bucket_sizes) - 1
+        i = 0
+        while i < len(values):
+            bucket_size = self.bucket_sizes[level]  # the last level's doubles as it goes
+            if partial[self.COUNT] > 0 or len(values) - i < bucket_size:
+                # top up the bucket being filled
+                chunk = values[i:i + bucket_size - int(partial[self.COUNT])]
+                if partial[self.COUNT] == 0:
+                    partial[:] = (self.length + i, 0, 0.0, np.inf, -np.inf)
+                partial[self.COUNT] += len(chunk)
+                partial[self.TOTAL] += chunk.sum()
+                partial[self.LOW] = min(partial[self.LOW], chunk.min())
+                partial[self.HIGH] = max(partial[self.HIGH], chunk.max())
+                i += len(chunk)
+                if partial[self.COUNT] == bucket_size:
+                    self._push(level, partial[np.newaxis])
+                    partial[self.COUNT] = 0
+                continue
+
+            # whole buckets straight from the values
+            count = (len(values) - i) // bucket_size
+            if last_level:
+                if self.filled[level] == self.size:
+                    self._merge_last_level()
+                    continue
+                count = min(count, self.size - self.filled[level])
+            blocks = values[i:i + count * bucket_size].reshape(count, bucket_size)
+            rows = np.empty((count, 5))
+            rows[:, self.START] = self.length + i + np.arange(count) * bucket_size
+            rows[:, self.COUNT] = bucket_size
+            rows[:, self.TOTAL] = blocks.sum(axis=1)
+            rows[:, self.LOW] = blocks.min(axis=1)
+            rows[:, self.HIGH] = blocks.max(axis=1)
+            self._push(level, rows)
+            i += count * bucket_size
+
+    def _push(self, level, rows):
+        buckets = self.buckets[level]
+        if level < len(self.bucket_sizes) - 1:
+            # only the last `size` of them survive in the ring anyway
+            first = self.filled[level] + max(len(rows) - self.size, 0)
+            rows = rows[-self.size:]
+            buckets[(first + np.arange(len(rows))) % self.size] = rows
+            self.filled[level] += len(rows) + (first - self.filled[level])
+            return
+        if self.filled[level] == self.size:
+            self._merge_last_level()
+        buckets[self.filled[level]:self.filled[level] + len(rows)] = rows
+        self.filled[level] += len(rows)
+
+    def _merge_last_level(self):
+        # the last level is full: halve its resolution to make room
+        buckets = self.buckets[-1]
+        first, second = buckets[0::2], buckets[1::2]
+        merged = first.copy()
+        merged[:, self.COUNT] += second[:, self.COUNT]
+        merged[:, self.TOTAL] += second[:, self.TOTAL]
+        merged[:, self.LOW] = np.minimum(first[:, self.LOW], second[:, self.LOW])
+        merged[:, self.HIGH] = np.maximum(first[:, self.HIGH], second[:, self.HIGH])
+        buckets[:self.size // 2] = merged
+        self.filled[-1] = self.size // 2
+        self.bucket_sizes[-1] *= 2
+
+    def _level_rows(self, level):
+        # completed buckets oldest first, plus the one being filled
+        filled = self.filled[level]
+        rows = self.buckets[level]
+        if filled > self.size:
+            rows = np.roll(rows, -(filled % self.size), axis=0)
+        else:
+            rows = rows[:filled]
+        if self.partial[level, self.COUNT] > 0:
+            rows = np.concatenate([rows, self.partial[level:level + 1]])
+        return rows
+
+    def series(self):  # returns (x, mean, low, high), x being the middle of each bucket in series positions
+        parts = []
+        covered_from = self.length
+        for level in range(len(self.bucket_sizes)):
+            rows = self._level_rows(level)
+            # finer levels already cover the rest, a bucket straddling their start is left out
+            rows = rows[rows[:, self.START] + rows[:, self.COUNT] <= covered_from]
+            if len(rows):
+                parts.append(rows)
+                covered_from = rows[0, self.START]
+        if not parts:
+            empty = np.zeros(0)
+            return empty, empty, empty, empty
+        rows = np.concatenate(parts[::-1])
+        x = rows[:, self.START] + (rows[:, self.COUNT] - 1) / 2
+        return x, rows[:, self.TOTAL] / rows[:, self.COUNT], rows[:, self.LOW], rows[:, self.HIGH]
+
+
+class EpisodeHistory:
+    """
+    Per-episode statistics the trainer needs, in memory that stays the same size however long training runs: ring
+    windows for the plotted moving average reward and for the average new best models are judged by.
+    The long-horizon series for the graphs live in plotter.py's SeriesArchives, fed from the metrics stream.
+    """
+
+    def __init__(self, mean_window, best_window):
+        self.reward_mean = RollingMean(mean_window)  # the plotted moving average
+        self.best_mean = RollingMean(best_window)  # the average new best models are judged by
+
+    def add_episode(self, reward):  # returns (moving average reward, average over best_window episodes)
+        return self.reward_mean.append(reward), self.best_mean.append(reward)
+
+    def state_dict(self):
+        return {'reward_mean': self.reward_mean.state_dict(), 'best_mean': self.best_mean.state_dict()}
+
+    def load_state_dict(self, state):
+        self.reward_mean.load_state_dict(state['reward_mean'])
+        self.best_mean.load_state_dict(state['best_mean'])
@@ -0,0 +1,103 @@
+from collections import deque
+import threading
+
+import torch
+
+
+class AsyncLearner:
+    """
+    Runs the agent's gradient updates on a background thread so they overlap with stepping the env.
+
+    The actor schedules updates with schedule() at the usual cadence (every train_freq env steps or at the end of an
+    episode) and keeps acting with its own copy of the policy network. Staleness is counted in updates: scheduled
+    updates that the actor's copy doesn't include yet. Once it goes over max_staleness, sync_actor() copies the
+    learner's weights over, first waiting for the learner to catch up if the learner itself is more than
+    max_staleness updates behind, so max_staleness=0 acts with the same weights as the synchronous loop.
+    Target network updates are asked for with schedule_target_update() and run on the learner thread once the
+    updates scheduled before them are done, the same order as the synchronous loop, so the actor never waits out a
+    gradient update for them.
+    The lock only guards changing the weights: learn() has to take it around its optimizer step and update_target()
+    runs under it, anything reading the networks from another thread (copying, saving) takes it too. Sampling,
+    forward and backward run without it.
+    """
+
+    def __init__(self, learn, update_target, policy_net, acting_net, max_staleness, num_threads=None):
+        self.learn = learn
+        self.update_target = update_target  # called with how many target updates are due at once
+        self.policy_params = list(policy_net.parameters())
+        self.acting_params = list(acting_net.parameters())
+        self.max_staleness = max_staleness
+        self.num_threads = num_threads
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()  # guards the counters below
+        self.scheduled = 0  # updates asked for by the actor
+        self.completed = 0  # updates done by the learner
+        self.acting_version = 0  # updates included in the actor's copy
+        self.target_updates = deque()  # (scheduled count to wait for, number of target updates) per request
+        self.error = None
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name='async-learner', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        if self.num_threads is not None:
+            # with the OpenMP backend (the default for CPU builds) this only applies to the calling thread
+            torch.set_num_threads(self.num_threads)
+        try:
+            while True:
+                with self.condition:
+                    while self.completed == self.scheduled and not self.target_updates and not self.stopping:
+                        self.condition.wait()
+                    if self.stopping:
+                        return
+                    # the target updates that are due now, several in a row are done as one
+                    target_updates = 0
+                    while self.target_updates and self.target_updates[0][0] <= self.completed:
+                        target_updates += self.target_updates.popleft()[1]
+                if target_updates:
+                    with self.lock:
+                        self.update_target(target_updates)
+                else:
+                    self.learn()
+                    with self.condition:
+                        self.completed += 1  # only ever written here, after the update's weights are in place
+                        self.condition.notify_all()
+        except BaseException as e:
+            with self.condition:
+                self.error = e
+                self.condition.notify_all()
+
+    def _check_error(self):
+        if self.error is not None:
+            raise RuntimeError("Learner thread failed") from self.error
+
+    def schedule(self, updates):
+        self._check_error()
+        with self.condition:
+            self.scheduled += updates
+            self.condition.notify_all()
+
+    def schedule_target_update(self, count=1):
+        self._check_error()
+        with self.condition:
+            self.target_updates.append((self.scheduled, count))
+            self.condition.notify_all()
+
+    def sync_actor(self):
+        if self.scheduled - self.acting_version <= self.max_staleness:
+            return
+        with self.condition:
+            while self.scheduled - self.completed > self.max_staleness and self.error is None:
+                self.condition.wait()
+        self._check_error()
+        with self.lock, torch.no_grad():
+            # completed can only lag the weights being copied, so the version recorded never overstates the copy
+            version = self.completed
+            torch._foreach_copy_(self.acting_params, self.policy_params)
+            self.acting_version = version
+
+    def close(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join()
@@ -0,0 +1,77 @@
+import os
+import struct
+import subprocess
+import sys
+
+import numpy as np
+
+# one fixed-size record per finished episode, appended to runs/<option>.metrics
+METRICS_DTYPE = np.dtype([('episode', '<i8'), ('reward', '<f8'), ('mean_reward', '<f8'), ('epsilon', '<f8')])
+METRICS_RECORD = struct.Struct('<qddd')
+assert METRICS_RECORD.size == METRICS_DTYPE.itemsize
+
+
+class MetricsStream:
+    """
+    Append-only binary stream of per-episode metrics, written by the trainer and tailed by plotter.py.
+
+    Records are packed with struct into a buffered file, so appending costs next to nothing and only flush() makes
+    them visible to the reader. The reader only ever takes whole records, a half written one is picked up on its
+    next read. A resumed run cuts the stream back to the checkpoint's episode first, dropping episodes that were
+    written after the checkpoint and are about to be played again.
+    """
+
+    def __init__(self, path, start_episode=0):
+        self.path = path
+        if start_episode > 0 and os.path.exists(path):
+            self._truncate(start_episode)
+            self.file = open(path, 'ab')
+        else:
+            self.file = open(path, 'wb')
+
+    def _truncate(self, start_episode):
+        count = os.path.getsize(self.path) // METRICS_DTYPE.itemsize
+        keep = 0
+        if count > 0:
+            records = np.memmap(self.path, dtype=METRICS_DTYPE, mode='r', shape=(count,))
+            keep = int(np.searchsorted(records['episode'], start_episode))
+            del records
+        os.truncate(self.path, keep * METRICS_DTYPE.itemsize)
+
+    def append(self, episode, reward, mean_reward, epsilon):
+        self.file.write(METRICS_RECORD.pack(episode, reward, mean_reward, epsilon))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_new_records(path, offset):  # returns (records, new offset) for the whole records after byte offset
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return np.zeros(0, dtype=METRICS_DTYPE), offset
+    count = (size - offset) // METRICS_DTYPE.itemsize
+    if count <= 0:
+        return np.zeros(0, dtype=METRICS_DTYPE), offset
+    records = np.fromfile(path, dtype=METRICS_DTYPE, count=count, offset=offset)
+    return records, offset + count * METRICS_DTYPE.itemsize
+
+
+def start_plotter(metrics_file, graph_file, interval=10):
+    # plotter.py runs as its own (niced) process, launched by path so the trainer never imports matplotlib.
+    # It redraws until its stdin closes, which also happens when the trainer dies.
+    plotter = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plotter.py')
+    return subprocess.Popen([sys.executable, plotter, metrics_file, graph_file, '--interval', str(interval)],
+                            stdin=subprocess.PIPE)
+
+
+def stop_plotter(process, timeout=60):
+    # closing stdin tells it to draw once more and exit
+    process.stdin.close()
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
@@ -0,0 +1,110 @@
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import torch
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # parquet output is optional, csv always works
+    pyarrow = None
+
+
+class MetricsTable:
+    """
+    One stream of rows with fixed columns, buffered in memory until the writer flushes it.
+
+    append() just stores the row: values that are still tensors (a loss, say) stay tensors until the flush turns
+    each column into one array, so recording them doesn't force a device sync per step. Appends and flushes may
+    come from different threads (the async learner records its updates itself).
+    """
+
+    def __init__(self, directory, name, columns, file_format):
+        self.directory = directory
+        self.name = name
+        self.columns = columns
+        self.file_format = file_format
+        self.rows = []
+        self.lock = threading.Lock()
+        self.parts = 0
+
+    def append(self, *values):
+        with self.lock:
+            self.rows.append(values)
+
+    def flush(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+        if not rows:
+            return
+        arrays = {}
+        for name, column in zip(self.columns, zip(*rows)):
+            if isinstance(column[0], torch.Tensor):
+                arrays[name] = torch.stack(column).float().cpu().numpy()
+            else:
+                arrays[name] = np.asarray(column)
+
+        if self.file_format == 'parquet':
+            # parquet files can't be appended to, each flush adds a part to the table's directory
+            table_dir = os.path.join(self.directory, self.name)
+            os.makedirs(table_dir, exist_ok=True)
+            while os.path.exists(os.path.join(table_dir, f'part-{self.parts:06d}.parquet')):
+                self.parts += 1  # a resumed run carries on after the existing parts
+            table = pyarrow.table(arrays)
+            pyarrow.parquet.write_table(table, os.path.join(table_dir, f'part-{self.parts:06d}.parquet'))
+            self.parts += 1
+        else:
+            path = os.path.join(self.directory, f'{self.name}.csv')
+            write_header = not os.path.exists(path)
+            # integers as integers, floats with the digits their dtype holds (time stamps need all of float64's)
+            formats = ['%.9g' if array.dtype == np.float32 else '%.15g' if array.dtype.kind == 'f' else '%d'
+                       for array in arrays.values()]
+            with open(path, 'a') as f:
+                if write_header:
+                    f.write(','.join(self.columns) + '\n')
+                np.savetxt(f, np.column_stack(list(arrays.values())), fmt=formats, delimiter=',')
+
+
+class MetricsWriter:
+    """
+    Full-resolution training metrics for analysis after the fact, as append-only tables under one directory.
+
+    Rows are buffered per table and written out in chunks every flush_interval seconds (checked by maybe_flush()),
+    either appended to <table>.csv or, with file_format='parquet' and pyarrow installed, as one more
+    <table>/part-NNNNNN.parquet. A resumed run appends to what is there; episodes replayed after resuming appear
+    again, the last occurrence of an episode number is the one that counts.
+    """
+
+    def __init__(self, directory, flush_interval=30, file_format='csv', resume=False):
+        if file_format not in ('csv', 'parquet'):
+            raise ValueError(f"Unknown metrics_format '{file_format}'")
+        if file_format == 'parquet' and pyarrow is None:
+            raise ValueError("metrics_format 'parquet' needs pyarrow installed")
+        if not resume:
+            shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.file_format = file_format
+        self.tables = []
+        self.last_flush_time = time.monotonic()
+
+    def table(self, name, columns):
+        table = MetricsTable(self.directory, name, columns, self.file_format)
+        self.tables.append(table)
+        return table
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush_time >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        for table in self.tables:
+            table.flush()
+        self.last_flush_time = time.monotonic()
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,44 @@
+from collections import deque
+
+import numpy as np
+import torch
+
+
+class NStepBuffer:
+    """
+    Turns one-step transitions into n-step ones on their way into the replay memory.
+
+    Keeps a window of the last n steps of the current episode. Once the window is full each new step emits
+    (s_t, a_t, r_t + g r_t+1 + ... + g^(n-1) r_t+n-1, s_t+n, done), so the learner bootstraps with g^n.
+    A terminal step flushes the whole window, each with the discounted rewards up to the end of the episode.
+    Steps left over when an episode stops without done (truncation, stop_on_reward) can't be bootstrapped with g^n
+    and are dropped by reset().
+    """
+
+    def __init__(self, n, gamma):
+        self.n = n
+        self.discounts = gamma ** np.arange(n)
+        self.window = deque(maxlen=n)
+
+    def append(self, transition):  # returns the list of n-step transitions that are ready for the replay memory
+        state, action, new_state, reward, done = transition
+        self.window.append((state, action, reward, float(reward)))
+
+        ready = []
+        if done:
+            while self.window:
+                ready.append(self._pop(new_state, True))
+        elif len(self.window) == self.n:
+            ready.append(self._pop(new_state, False))
+        return ready
+
+    def _pop(self, new_state, done):
+        rewards = np.array([reward_value for _, _, _, reward_value in self.window])
+        state, action, reward, _ = self.window.popleft()
+        n_step_reward = float(np.dot(self.discounts[:len(rewards)], rewards))
+        if isinstance(reward, torch.Tensor):
+            n_step_reward = torch.tensor(n_step_reward, dtype=reward.dtype, device=reward.device)
+        return state, action, new_state, n_step_reward, done
+
+    def reset(self):
+        self.window.clear()
@@ -0,0 +1,82 @@
+"""
+Draws the training graph for agent.py in a separate, low priority process.
+
+Tails the metrics stream the trainer appends to (see metrics_stream.py), keeps the series in bounded SeriesArchives
+and redraws the PNG every few seconds when there's something new. Exits after a last redraw once stdin is closed,
+which the trainer does when training ends (and the OS does if the trainer dies).
+
+    python plotter.py runs/<option>.metrics runs/<option>.png [--interval seconds]
+"""
+import argparse
+import os
+import sys
+import threading
+
+import matplotlib
+import matplotlib.pyplot as plt
+
+from history import SeriesArchive
+from metrics_stream import read_new_records
+
+matplotlib.use('Agg')
+
+
+def save_graph(graph_file, mean_rewards, epsilons):
+    # Save plots
+    fig = plt.figure(1)
+
+    # Plot average rewards (Y-axis) vs episodes (X-axis)
+    # both series come out of bounded archives: recent episodes one point each, older ones as bucket means,
+    # with the band showing each bucket's min and max
+    plt.subplot(121)  # plot on a 1 row x 2 col grid, at cell 1
+    # plt.xlabel('Episodes')
+    plt.ylabel('Mean Rewards')
+    x, mean, low, high = mean_rewards.series()
+    plt.fill_between(x, low, high, alpha=0.3)
+    plt.plot(x, mean)
+
+    # Plot epsilon decay (Y-axis) vs episodes (X-axis)
+    plt.subplot(122)  # plot on a 1 row x 2 col grid, at cell 2
+    # plt.xlabel('Episodes')
+    plt.ylabel('Epsilon Decay')
+    x, mean, low, high = epsilons.series()
+    plt.plot(x, mean)
+
+    plt.subplots_adjust(wspace=1.0, hspace=1.0)
+
+    # Save plots, next to the old file and swapped in so a viewer never catches half a PNG
+    fig.savefig(graph_file + '.tmp', format='png')
+    plt.close(fig)
+    os.replace(graph_file + '.tmp', graph_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Redraw the training graph from the metrics stream.')
+    parser.add_argument('metrics_file')
+    parser.add_argument('graph_file')
+    parser.add_argument('--interval', type=float, default=10, help='seconds between redraws')
+    args = parser.parse_args()
+
+    if hasattr(os, 'nice'):
+        os.nice(10)  # drawing should never compete with the trainer
+
+    # stdin reaching EOF is the signal to stop
+    stopping = threading.Event()
+    threading.Thread(target=lambda: (sys.stdin.read(), stopping.set()), daemon=True).start()
+
+    mean_rewards = SeriesArchive()
+    epsilons = SeriesArchive()
+    offset = 0
+    while True:
+        stopped = stopping.wait(args.interval)
+        records, offset = read_new_records(args.metrics_file, offset)
+        if len(records):
+            mean_rewards.extend(records['mean_reward'])
+            epsilons.extend(records['epsilon'])
+            save_graph(args.graph_file, mean_rewards, epsilons)
+        if stopped:
+            break
+
+
+if __name__ == '__main__':
+    main()
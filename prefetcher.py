@@ -0,0 +1,83 @@
+import queue
+import threading
+
+_FAILED = object()  # queued in place of a batch when sampling failed on the background thread
+
+
+class BatchPrefetcher:
+    """
+    Assembles mini batches from a replay memory on a background thread.
+
+    The thread keeps a bounded queue topped up with ready-stacked batches (already on the memory's device) while the
+    main thread steps the env or runs a gradient step, so sample() usually just pops a finished batch.
+    It stands in for the memory on the training side: append(), sample(), update_priorities() and save() go through it,
+    and a lock keeps the sampler from reading a transition that is halfway written.
+    """
+
+    def __init__(self, memory, batch_size, queue_size=2):
+        self.memory = memory
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.has_data = threading.Event()
+        self.stop_event = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='batch-prefetcher', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        self.has_data.wait()
+        while not self.stop_event.is_set():
+            try:
+                with self.lock:
+                    batch = self.memory.sample(self.batch_size)
+            except Exception as e:
+                # handed to whoever calls sample() next, instead of leaving them waiting for a batch that never comes
+                self.error = e
+                batch = _FAILED
+            # blocks while the queue is full, waking up now and then to check for close()
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if batch is _FAILED:
+                return
+
+    def append(self, transition):
+        with self.lock:
+            self.memory.append(transition)
+        if not self.has_data.is_set() and len(self.memory) >= self.batch_size:
+            self.has_data.set()
+
+    def append_batch(self, batch):
+        with self.lock:
+            self.memory.append_batch(batch)
+        if not self.has_data.is_set() and len(self.memory) >= self.batch_size:
+            self.has_data.set()
+
+    def sample(self, batch_size):
+        if batch_size != self.batch_size:
+            raise ValueError(f"Prefetcher was set up for batches of {self.batch_size}, not {batch_size}")
+        batch = self.queue.get()
+        if batch is _FAILED:
+            self.queue.put(_FAILED)  # any later call fails the same way
+            raise RuntimeError("Sampling a batch on the prefetch thread failed") from self.error
+        return batch
+
+    def update_priorities(self, indices, td_errors):
+        with self.lock:
+            self.memory.update_priorities(indices, td_errors)
+
+    def save(self, directory):
+        with self.lock:
+            self.memory.save(directory)
+
+    def __len__(self):
+        return len(self.memory)
+
+    def close(self):
+        self.stop_event.set()
+        self.has_data.set()
+        self.thread.join()
@@ -1,19 +1,542 @@
 from collections import deque
-import random
+import json
+import os
+import shutil
+
+import numpy as np
+import torch
+
+from segment_tree import SumTree, MinTree
+
+
+def compact_observation_dtype(observation_space):
+    """
+    Smallest dtype that stores observations from observation_space without loss.
+
+    Bounded integer (and boolean) Box spaces get the narrowest integer type covering their bounds, e.g. uint8 for
+    the car game's 0..10 radar readings. Float observations are kept as float32, which is what the network consumes
+    anyway; narrower floats lose precision so they have to be asked for explicitly.
+    """
+    dtype = np.dtype(observation_space.dtype)
+    if dtype == np.bool_:
+        return np.dtype(np.uint8)
+    if np.issubdtype(dtype, np.integer):
+        low, high = np.min(observation_space.low), np.max(observation_space.high)
+        for candidate in (np.uint8, np.int8, np.int16, np.int32):
+            info = np.iinfo(candidate)
+            if info.min <= low and high <= info.max:
+                return np.dtype(candidate)
+    return np.dtype(np.float32)
+
+
+def _save_snapshot(directory, arrays, header):
+    """
+    Write a replay snapshot: one .npy file per array plus header.json with the scalar state.
+
+    The snapshot is assembled next to directory and then swapped in, so an interrupted save leaves the previous
+    snapshot intact instead of a mix of old and new files.
+    """
+    directory = os.path.normpath(directory)
+    tmp_directory = directory + '.tmp'
+    old_directory = directory + '.old'
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_directory, f'{name}.npy'), array)
+    with open(os.path.join(tmp_directory, 'header.json'), 'w') as f:
+        json.dump({**header, 'arrays': list(arrays)}, f)
+
+    shutil.rmtree(old_directory, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, old_directory)
+    os.rename(tmp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+
+
+def _load_snapshot(directory, expected_header):
+    with open(os.path.join(directory, 'header.json'), 'r') as f:
+        header = json.load(f)
+    for key, value in expected_header.items():
+        if header.get(key) != value:
+            raise ValueError(f"Replay snapshot in {directory} has {key}={header.get(key)}, expected {value}")
+    arrays = {name: np.load(os.path.join(directory, f'{name}.npy')) for name in header['arrays']}
+    return header, arrays
+
+
+def _sample_indices(rng, population, batch_size, replace=False):
+    if replace:
+        return rng.integers(0, population, size=batch_size)
+    # without replacement numpy only does work proportional to batch_size for small batches from large populations
+    return rng.choice(population, size=batch_size, replace=False)
+
+
+def _to_numpy(x):
+    # transitions may come in as tensors (possibly on the gpu) or as raw env output
+    if isinstance(x, torch.Tensor):
+        return x.detach().cpu().numpy()
+    return x
 
 
 class ReplayMemory:
-    def __init__(self, capacity, seed=None):
+    def __init__(self, capacity, seed=None, device='cpu', state_shape=()):
         self.memory = deque(maxlen=capacity)
-        if seed is not None:
-            random.seed(seed)
+        self.device = device
+        self.state_shape = tuple(state_shape)  # only needed to save an empty buffer
+        # own random stream, seed can be an int or a numpy SeedSequence (e.g. one spawned per actor)
+        self.rng = np.random.default_rng(seed)
 
     def append(self, transition):  # transition is a tuple of (state, action, next_state, reward, done)
-        # append a transition to the buffer
-        self.memory.append(transition)
+        # append a transition to the buffer, as tensors on the device so sample() only has to stack them
+        state, action, new_state, reward, done = transition
+        self.memory.append((torch.as_tensor(state, dtype=torch.float, device=self.device),
+                            torch.as_tensor(action, dtype=torch.int64, device=self.device),
+                            torch.as_tensor(new_state, dtype=torch.float, device=self.device),
+                            torch.as_tensor(reward, dtype=torch.float, device=self.device), bool(done)))
 
-    def sample(self, batch_size):
-        return random.sample(self.memory, batch_size)
+    def append_batch(self, batch):  # batch is a tuple of (states, actions, next_states, rewards, dones) batches
+        states, actions, new_states, rewards, dones = batch
+        self.memory.extend(zip(torch.as_tensor(np.asarray(states), dtype=torch.float, device=self.device),
+                               torch.as_tensor(np.asarray(actions), dtype=torch.int64, device=self.device),
+                               torch.as_tensor(np.asarray(new_states), dtype=torch.float, device=self.device),
+                               torch.as_tensor(np.asarray(rewards), dtype=torch.float, device=self.device),
+                               np.asarray(dones, dtype=bool).tolist()))
+
+    @property
+    def capacity(self):
+        return self.memory.maxlen
+
+    @classmethod
+    def capacity_for_bytes(cls, nbytes, state_shape, state_dtype=np.float32):
+        # every transition is a tuple of four tensors with their own storages, the Python and allocator overhead
+        # is several times the payload and depends on the torch build, so a byte budget can't be honoured here
+        raise ValueError("replay_memory_bytes isn't supported for the 'deque' replay memory, use "
+                         "replay_memory_size or one of the array backings")
+
+    @property
+    def nbytes(self):  # the tensor payload only, the tuples and tensor objects around it take several times that
+        if not self.memory:
+            return 0
+        return len(self.memory) * sum(t.element_size() * t.nelement() for t in self.memory[0]
+                                      if isinstance(t, torch.Tensor))
+
+    def sample(self, batch_size, replace=False):
+        mini_batch = [self.memory[i] for i in _sample_indices(self.rng, len(self.memory), batch_size, replace)]
+
+        # transpose the batch of experiences and stack tensors to create batch tensors
+        states, actions, new_states, rewards, dones = zip(*mini_batch)
+        states = torch.stack(states)
+        return (states, torch.stack(actions), torch.stack(new_states), torch.stack(rewards),
+                torch.tensor(dones).float().to(states.device))
+
+    def save(self, directory):
+        # stacked into one array per field, no pickled tuples
+        if self.memory:
+            states, actions, new_states, rewards, dones = zip(*self.memory)
+            arrays = {'states': torch.stack(states).cpu().numpy(), 'actions': torch.stack(actions).cpu().numpy(),
+                      'new_states': torch.stack(new_states).cpu().numpy(),
+                      'rewards': torch.stack(rewards).cpu().numpy(), 'dones': np.array(dones, dtype=bool)}
+        else:
+            arrays = {'states': np.zeros((0, *self.state_shape), dtype=np.float32),
+                      'actions': np.zeros(0, dtype=np.int64),
+                      'new_states': np.zeros((0, *self.state_shape), dtype=np.float32),
+                      'rewards': np.zeros(0, dtype=np.float32), 'dones': np.zeros(0, dtype=bool)}
+        _save_snapshot(directory, arrays, {'type': 'deque', 'capacity': self.capacity,
+                                           'rng_state': self.rng.bit_generator.state})
+
+    def load(self, directory):
+        header, arrays = _load_snapshot(directory, {'type': 'deque', 'capacity': self.capacity})
+        tensors = [torch.as_tensor(arrays[name], device=self.device)
+                   for name in ('states', 'actions', 'new_states', 'rewards')]
+        self.memory.clear()
+        self.memory.extend(zip(*tensors, arrays['dones'].tolist()))
+        self.rng.bit_generator.state = header['rng_state']
+
+    def __len__(self):
+        return len(self.memory)
+
+
+class ArrayReplayMemory:
+    """
+    Ring buffer backed by preallocated contiguous arrays, one per transition field.
+
+    Sampling is O(batch_size) regardless of capacity and sample() hands back ready-stacked batch tensors
+    in the same (states, actions, new_states, rewards, dones) layout as ReplayMemory.sample().
+    """
+
+    def __init__(self, capacity, state_shape, device='cpu', seed=None, state_dtype=np.float32):
+        self.capacity = capacity
+        self.device = device
+        # observations are stored as state_dtype and only converted to float32 for the sampled batch
+        self.states = self._allocate('states', (capacity, *state_shape), state_dtype)
+        self.actions = self._allocate('actions', (capacity,), np.int64)
+        self.new_states = self._allocate('new_states', (capacity, *state_shape), state_dtype)
+        self.rewards = self._allocate('rewards', (capacity,), np.float32)
+        self.dones = self._allocate('dones', (capacity,), np.float32)
+        self.cursor = 0  # next slot to write, the oldest transition gets overwritten once the buffer is full
+        self.size = 0
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def transition_nbytes(cls, state_shape, state_dtype=np.float32):
+        # two observations plus an int64 action, float32 reward and float32 done flag
+        return 2 * np.dtype(state_dtype).itemsize * int(np.prod(state_shape)) + 8 + 4 + 4
+
+    @classmethod
+    def capacity_for_bytes(cls, nbytes, state_shape, state_dtype=np.float32):
+        return max(1, int(nbytes // cls.transition_nbytes(state_shape, state_dtype)))
+
+    def _allocate(self, name, shape, dtype):
+        return np.zeros(shape, dtype=dtype)
+
+    def _arrays(self):
+        return {'states': self.states, 'actions': self.actions, 'new_states': self.new_states,
+                'rewards': self.rewards, 'dones': self.dones}
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self._arrays().values())
+
+    def _snapshot_header(self):
+        return {'type': type(self).__name__, 'capacity': self.capacity, 'state_shape': list(self.states.shape[1:]),
+                'state_dtype': self.states.dtype.str, 'cursor': self.cursor, 'size': self.size,
+                'rng_state': self.rng.bit_generator.state}
+
+    def _snapshot_arrays(self):
+        # only the filled rows: while filling up that's [0, size) and once full it's everything
+        return {name: array[:self.size] for name, array in self._arrays().items()}
+
+    def _restore_header(self, header):
+        self.cursor = header['cursor']
+        self.size = header['size']
+        self.rng.bit_generator.state = header['rng_state']
+
+    def save(self, directory):
+        _save_snapshot(directory, self._snapshot_arrays(), self._snapshot_header())
+
+    def load(self, directory):
+        expected = {key: value for key, value in self._snapshot_header().items()
+                    if key in ('type', 'capacity', 'state_shape', 'state_dtype')}
+        header, arrays = _load_snapshot(directory, expected)
+        for name, array in arrays.items():
+            self._restore_array(name, array)
+        self._restore_header(header)
+
+    def _restore_array(self, name, array):
+        # copy into the preallocated arrays, which also works when they are memory-mapped
+        self._arrays()[name][:len(array)] = array
+
+    def append(self, transition):  # transition is a tuple of (state, action, next_state, reward, done)
+        state, action, new_state, reward, done = transition
+        i = self.cursor
+        self.states[i] = _to_numpy(state)
+        self.actions[i] = _to_numpy(action)
+        self.new_states[i] = _to_numpy(new_state)
+        self.rewards[i] = _to_numpy(reward)
+        self.dones[i] = done
+        self.cursor = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def append_batch(self, batch):  # batch is a tuple of (states, actions, next_states, rewards, dones) batches
+        states, actions, new_states, rewards, dones = batch
+        indices = (self.cursor + np.arange(len(dones))) % self.capacity
+        self.states[indices] = _to_numpy(states)
+        self.actions[indices] = _to_numpy(actions)
+        self.new_states[indices] = _to_numpy(new_states)
+        self.rewards[indices] = _to_numpy(rewards)
+        self.dones[indices] = _to_numpy(dones)
+        self.cursor = (self.cursor + len(dones)) % self.capacity
+        self.size = min(self.size + len(dones), self.capacity)
+        return indices
+
+    def sample(self, batch_size, replace=False):
+        return self._batch(_sample_indices(self.rng, self.size, batch_size, replace))
+
+    def _batch(self, indices):
+        # fancy indexing copies just the sampled rows, which then go to the device in one transfer per field
+        # compact observations are widened to float32 after the transfer
+        return (torch.as_tensor(self.states[indices], device=self.device).float(),
+                torch.as_tensor(self.actions[indices], device=self.device),
+                torch.as_tensor(self.new_states[indices], device=self.device).float(),
+                torch.as_tensor(self.rewards[indices], device=self.device),
+                torch.as_tensor(self.dones[indices], device=self.device))
 
     def __len__(self):
-        return len(self.memory)
\ No newline at end of file
+        return self.size
+
+
+class MmapReplayMemory(ArrayReplayMemory):
+    """
+    ArrayReplayMemory whose arrays are memory-mapped .npy files in a directory, so capacity is bounded by disk
+    rather than RAM and the OS pages transitions in and out as needed.
+
+    The write cursor and size go into a small header.json every flush_interval appends (and on flush()).
+    With reopen=True, constructing it again on the same directory with the same capacity and state shape reopens
+    the existing files in place instead of reallocating, so a resumed run keeps its collected experience.
+    Otherwise whatever is in the directory is replaced by an empty buffer.
+    """
+
+    HEADER_FILE = 'header.json'
+
+    def __init__(self, capacity, state_shape, directory, device='cpu', seed=None, state_dtype=np.float32,
+                 flush_interval=10000, reopen=False):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        header_path = os.path.join(directory, self.HEADER_FILE)
+        header = None
+        if not reopen and os.path.exists(header_path):
+            os.remove(header_path)  # the arrays are about to be recreated, the old cursor doesn't apply to them
+        elif os.path.exists(header_path):
+            with open(header_path, 'r') as f:
+                header = json.load(f)
+            if header['capacity'] != capacity or header['state_shape'] != list(state_shape):
+                header = None  # incompatible layout, start over
+        self.reopen = header is not None
+
+        super().__init__(capacity, state_shape, device=device, seed=seed, state_dtype=state_dtype)
+
+        if self.reopen:
+            self.cursor = header['cursor']
+            self.size = header['size']
+        self.appends_since_flush = 0
+
+    def _allocate(self, name, shape, dtype):
+        path = os.path.join(self.directory, f'{name}.npy')
+        if self.reopen:
+            if os.path.exists(path):
+                array = np.load(path, mmap_mode='r+')
+                if array.shape == shape and array.dtype == dtype:
+                    return array
+            self.reopen = False  # a missing or mismatched file means the saved cursor can't be trusted
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    def append(self, transition):
+        super().append(transition)
+        self.appends_since_flush += 1
+        if self.appends_since_flush >= self.flush_interval:
+            self.flush()
+
+    def append_batch(self, batch):
+        indices = super().append_batch(batch)
+        self.appends_since_flush += len(indices)
+        if self.appends_since_flush >= self.flush_interval:
+            self.flush()
+        return indices
+
+    def flush(self):
+        for array in self._arrays().values():
+            array.flush()
+        header = {'capacity': self.capacity, 'state_shape': list(self.states.shape[1:]),
+                  'cursor': self.cursor, 'size': self.size}
+        # write to a temp file and swap it in so a crash never leaves a truncated header behind
+        header_path = os.path.join(self.directory, self.HEADER_FILE)
+        with open(header_path + '.tmp', 'w') as f:
+            json.dump(header, f)
+        os.replace(header_path + '.tmp', header_path)
+        self.appends_since_flush = 0
+
+
+class EpisodicReplayMemory:
+    """
+    Replay memory that stores each observation once, as a single stream of observation slots.
+
+    Consecutive transitions of an episode share an observation: slot i holds s_t together with a_t, r_t and done_t,
+    and the next state is rebuilt at sample time from slot i + 1. An episode of n steps therefore takes n + 1 slots
+    instead of the 2n observations a (state, action, next_state, reward, done) tuple per step needs.
+    append() and sample() keep the same contract as ReplayMemory, a new segment is started whenever the incoming
+    state isn't the previous transition's next state (after done, a truncation or the first step).
+    """
+
+    def __init__(self, capacity, state_shape, device='cpu', seed=None, state_dtype=np.float32):
+        self.capacity = max(capacity, 2)  # counted in observation slots
+        self.device = device
+        self.observations = np.zeros((self.capacity, *state_shape), dtype=state_dtype)
+        self.actions = np.zeros(self.capacity, dtype=np.int64)
+        self.rewards = np.zeros(self.capacity, dtype=np.float32)
+        self.dones = np.zeros(self.capacity, dtype=np.float32)
+        self.has_transition = np.zeros(self.capacity, dtype=bool)  # slot i + 1 holds the next state of slot i
+        self.cursor = 0
+        self.slots_used = 0
+        self.size = 0  # number of sampleable transitions
+        self.episode_open = False  # the last written slot is the latest observation of an ongoing episode
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def capacity_for_bytes(cls, nbytes, state_shape, state_dtype=np.float32):
+        # per slot: one observation, an int64 action, float32 reward and done and the has_transition flag
+        slot_nbytes = np.dtype(state_dtype).itemsize * int(np.prod(state_shape)) + 8 + 4 + 4 + 1
+        return max(2, int(nbytes // slot_nbytes))
+
+    def _arrays(self):
+        return {'observations': self.observations, 'actions': self.actions, 'rewards': self.rewards,
+                'dones': self.dones, 'has_transition': self.has_transition}
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self._arrays().values())
+
+    def _snapshot_header(self):
+        return {'type': type(self).__name__, 'capacity': self.capacity,
+                'state_shape': list(self.observations.shape[1:]), 'state_dtype': self.observations.dtype.str,
+                'cursor': self.cursor, 'slots_used': self.slots_used, 'size': self.size,
+                'episode_open': self.episode_open, 'rng_state': self.rng.bit_generator.state}
+
+    def save(self, directory):
+        arrays = {name: array[:self.slots_used] for name, array in self._arrays().items()}
+        _save_snapshot(directory, arrays, self._snapshot_header())
+
+    def load(self, directory):
+        expected = {key: value for key, value in self._snapshot_header().items()
+                    if key in ('type', 'capacity', 'state_shape', 'state_dtype')}
+        header, arrays = _load_snapshot(directory, expected)
+        targets = self._arrays()
+        for name, array in arrays.items():
+            targets[name][:len(array)] = array
+        self.cursor = header['cursor']
+        self.slots_used = header['slots_used']
+        self.size = header['size']
+        self.episode_open = header['episode_open']
+        self.rng.bit_generator.state = header['rng_state']
+
+    def _write_observation(self, observation):
+        i = self.cursor
+        if self.has_transition[i]:
+            # overwriting the oldest slot drops the transition that started there
+            self.has_transition[i] = False
+            self.size -= 1
+        self.observations[i] = observation
+        self.cursor = (i + 1) % self.capacity
+        self.slots_used = min(self.slots_used + 1, self.capacity)
+        return i
+
+    def append(self, transition):  # transition is a tuple of (state, action, next_state, reward, done)
+        state, action, new_state, reward, done = transition
+        state = np.asarray(_to_numpy(state), dtype=self.observations.dtype)
+
+        last = (self.cursor - 1) % self.capacity
+        if not (self.episode_open and np.array_equal(self.observations[last], state)):
+            last = self._write_observation(state)
+        self.actions[last] = _to_numpy(action)
+        self.rewards[last] = _to_numpy(reward)
+        self.dones[last] = done
+        self._write_observation(_to_numpy(new_state))
+        self.has_transition[last] = True
+        self.size += 1
+        self.episode_open = not done
+
+    def append_batch(self, batch):
+        # one at a time to keep the segment bookkeeping; transitions from interleaved envs rarely chain, so a
+        # vector env mostly gets two slots per transition here
+        for transition in zip(*batch):
+            self.append(transition)
+
+    def sample(self, batch_size, replace=False):
+        # rejection sample slot indices, only the last observation of each segment has no transition
+        indices = np.empty(0, dtype=np.int64)
+        while len(indices) < batch_size:
+            candidates = _sample_indices(self.rng, self.slots_used, batch_size - len(indices), replace)
+            indices = np.concatenate((indices, candidates[self.has_transition[candidates]]))
+        next_indices = (indices + 1) % self.capacity
+
+        return (torch.as_tensor(self.observations[indices], device=self.device).float(),
+                torch.as_tensor(self.actions[indices], device=self.device),
+                torch.as_tensor(self.observations[next_indices], device=self.device).float(),
+                torch.as_tensor(self.rewards[indices], device=self.device),
+                torch.as_tensor(self.dones[indices], device=self.device))
+
+    def __len__(self):
+        return self.size
+
+
+class PrioritizedReplayMemory(ArrayReplayMemory):
+    """
+    Proportional prioritized experience replay (Schaul et al. 2016) on top of ArrayReplayMemory.
+
+    Priorities live in a sum tree (for sampling) and a min tree (for the largest importance-sampling weight).
+    New transitions get the highest priority seen so far; their tree updates are queued and applied together
+    with the next sample() so the per-step cost of append() stays the same as the plain array buffer.
+    """
+
+    def __init__(self, capacity, state_shape, device='cpu', seed=None, state_dtype=np.float32, alpha=0.6, beta=0.4,
+                 beta_increment=0.0, epsilon=1e-6):
+        super().__init__(capacity, state_shape, device=device, seed=seed, state_dtype=state_dtype)
+        self.alpha = alpha  # how strongly priorities skew sampling, 0 is uniform
+        self.beta = beta  # importance-sampling correction, annealed towards 1 by beta_increment per sample
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon  # keeps zero td error transitions sampleable
+        self.sum_tree = SumTree(capacity)
+        self.min_tree = MinTree(capacity)
+        self.max_priority = 1.0
+        self.pending = []  # slots appended since the last sample, not yet in the trees
+
+    @classmethod
+    def transition_nbytes(cls, state_shape, state_dtype=np.float32):
+        # plus a float64 leaf and (amortized) internal node in each of the two trees
+        return super().transition_nbytes(state_shape, state_dtype) + 2 * 2 * 8
+
+    @property
+    def nbytes(self):
+        return super().nbytes + self.sum_tree.tree.nbytes + self.min_tree.tree.nbytes
+
+    def append(self, transition):
+        self.pending.append(self.cursor)
+        super().append(transition)
+
+    def append_batch(self, batch):
+        indices = super().append_batch(batch)
+        self.pending.extend(indices.tolist())
+        return indices
+
+    def _apply_pending(self):
+        if self.pending:
+            self._set_priorities(self.pending, self.max_priority)
+            self.pending = []
+
+    def _snapshot_header(self):
+        # max_priority comes out of numpy, json only takes plain floats
+        return {**super()._snapshot_header(), 'max_priority': float(self.max_priority), 'beta': float(self.beta)}
+
+    def _snapshot_arrays(self):
+        self._apply_pending()
+        return {**super()._snapshot_arrays(), 'sum_tree': self.sum_tree.tree, 'min_tree': self.min_tree.tree}
+
+    def _restore_header(self, header):
+        super()._restore_header(header)
+        self.max_priority = header['max_priority']
+        self.beta = header['beta']
+        self.pending = []
+
+    def _restore_array(self, name, array):
+        trees = {'sum_tree': self.sum_tree, 'min_tree': self.min_tree}
+        if name in trees:
+            trees[name].tree[:] = array
+        else:
+            super()._restore_array(name, array)
+
+    def sample(self, batch_size):
+        # stratified draws are effectively with replacement, a high priority transition can fill several slices
+        self._apply_pending()
+
+        # stratified sampling: one draw from each of batch_size equal slices of the total priority mass
+        total = self.sum_tree.reduce()
+        prefix_sums = (np.arange(batch_size) + self.rng.random(batch_size)) * (total / batch_size)
+        indices = np.minimum(self.sum_tree.find_prefix_sum_index(prefix_sums), self.size - 1)
+
+        # importance-sampling weights, normalized by the largest possible weight so they only scale the loss down
+        probabilities = self.sum_tree[indices] / total
+        min_probability = self.min_tree.reduce() / total
+        weights = (probabilities / min_probability) ** -self.beta
+        self.beta = min(1.0, self.beta + self.beta_increment)
+
+        weights = torch.as_tensor(weights, dtype=torch.float, device=self.device)
+        return self._batch(indices), weights, indices
+
+    def update_priorities(self, indices, td_errors):
+        priorities = np.abs(_to_numpy(td_errors)) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self._set_priorities(indices, priorities)
+
+    def _set_priorities(self, indices, priorities):
+        priorities = np.asarray(priorities, dtype=np.float64) ** self.alpha
+        self.sum_tree.update(indices, priorities)
+        self.min_tree.update(indices, priorities)
@@ -0,0 +1,53 @@
+import numpy as np
+
+
+class SegmentTree:
+    """
+    Array backed binary segment tree over a fixed number of leaves.
+
+    Node 1 is the root, node i has children 2i and 2i+1 and the leaves live at [capacity, 2 * capacity).
+    Updates take a whole batch of leaves at once and recompute their ancestors one tree level at a time,
+    so the Python overhead is O(log n) numpy calls per batch rather than a tree walk per item.
+    """
+
+    def __init__(self, capacity, operation, neutral_element):
+        # round up to a power of 2 so every leaf sits at the same depth
+        self.capacity = 1 << max(capacity - 1, 0).bit_length()
+        self.operation = operation
+        self.tree = np.full(2 * self.capacity, neutral_element, dtype=np.float64)
+
+    def update(self, indices, values):
+        nodes = np.asarray(indices, dtype=np.int64) + self.capacity
+        self.tree[nodes] = values
+        while nodes[0] > 1:
+            # siblings share a parent, recomputing it twice writes the same value so no need to dedupe
+            nodes //= 2
+            self.tree[nodes] = self.operation(self.tree[2 * nodes], self.tree[2 * nodes + 1])
+
+    def __getitem__(self, indices):
+        return self.tree[np.asarray(indices) + self.capacity]
+
+    def reduce(self):
+        return self.tree[1]
+
+
+class SumTree(SegmentTree):
+    def __init__(self, capacity):
+        super().__init__(capacity, np.add, 0.0)
+
+    def find_prefix_sum_index(self, prefix_sums):
+        # descend from the root for all prefix sums at once, going right whenever the prefix is past the left subtree
+        prefix_sums = np.array(prefix_sums, dtype=np.float64)
+        nodes = np.ones(len(prefix_sums), dtype=np.int64)
+        while nodes[0] < self.capacity:
+            left = 2 * nodes
+            left_sums = self.tree[left]
+            go_right = prefix_sums > left_sums
+            prefix_sums -= np.where(go_right, left_sums, 0.0)
+            nodes = left + go_right
+        return nodes - self.capacity
+
+
+class MinTree(SegmentTree):
+    def __init__(self, capacity):
+        super().__init__(capacity, np.minimum, float('inf'))
@@ -0,0 +1,102 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+
+class SharedWeights:
+    """
+    A network's parameters in shared memory, written by the learner and read in place by actor processes.
+
+    There are two slots, each holding all parameters flattened as float32. publish() copies the learner's parameters
+    into the slot that isn't the current one and bumps the version. Readers never copy: bind() turns their module's
+    parameters into views on the current slot, and refresh() is a version check plus repointing those views at the
+    other slot. Every reader records which slot it is on, and the learner skips a publish (publish() returns False)
+    while any reader is still on the slot it would overwrite, so a forward pass never sees half written weights.
+    A reader process that dies keeps its claim, release() drops it.
+    """
+
+    def __init__(self, module, num_readers, ctx):
+        self.shapes = [tuple(p.shape) for p in module.parameters()]
+        self.size = sum(int(np.prod(shape)) for shape in self.shapes)
+        self.shm = shared_memory.SharedMemory(create=True, size=2 * self.size * 4)
+        self.owner = True
+        self.version = ctx.Value('q', 0)  # 0 until the first publish, the current slot is version % 2
+        self.in_use = ctx.Array('q', [-1] * num_readers)  # slot each reader is on, -1 before it binds
+        self._attach()
+
+    def _attach(self):
+        flat = torch.from_numpy(np.ndarray((2, self.size), dtype=np.float32, buffer=self.shm.buf))
+        self.slots = []
+        for slot in flat:
+            views = []
+            offset = 0
+            for shape in self.shapes:
+                count = int(np.prod(shape))
+                views.append(slot[offset:offset + count].view(shape))
+                offset += count
+            self.slots.append(views)
+        self.params = None
+
+    def __getstate__(self):
+        # sent to the actor process: the block is reattached by name rather than copied
+        return {'shapes': self.shapes, 'size': self.size, 'shm_name': self.shm.name, 'version': self.version,
+                'in_use': self.in_use}
+
+    def __setstate__(self, state):
+        self.shapes = state['shapes']
+        self.size = state['size']
+        self.shm = shared_memory.SharedMemory(name=state['shm_name'])
+        self.owner = False
+        self.version = state['version']
+        self.in_use = state['in_use']
+        self._attach()
+
+    def publish(self, module):  # learner side, returns False when a reader still holds the slot to write
+        version = self.version.value
+        target = (version + 1) % 2
+        if target in self.in_use[:]:
+            return False
+        with torch.no_grad():
+            for view, param in zip(self.slots[target], module.parameters()):
+                view.copy_(param)  # one copy per parameter, also brings them over from the GPU
+        self.version.value = version + 1
+        return True
+
+    def release(self, reader_id):  # learner side, for a reader that has gone away without leaving its slot
+        self.in_use[reader_id] = -1
+
+    def bind(self, module, reader_id):  # reader side, waits for the first publish
+        self.params = list(module.parameters())
+        self.reader_id = reader_id
+        self.bound_version = 0
+        while not self.refresh():
+            time.sleep(0.01)
+
+    def refresh(self):  # reader side, returns True when the module now sees newer weights
+        version = self.version.value
+        if version == self.bound_version:
+            return False
+        while True:
+            # claim the slot, then make sure it wasn't swapped out between reading the version and claiming it
+            self.in_use[self.reader_id] = version % 2
+            latest = self.version.value
+            if latest == version:
+                break
+            version = latest
+        for param, view in zip(self.params, self.slots[version % 2]):
+            param.data = view
+        self.bound_version = version
+        return True
+
+    def close(self):
+        # drop the views first, SharedMemory refuses to close while they still point into the block
+        if self.params is not None:
+            for param in self.params:
+                param.data = param.data.clone()
+            self.params = None
+        self.slots = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
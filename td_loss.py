@@ -0,0 +1,46 @@
+from typing import Optional
+
+import torch
+from torch import nn
+
+
+class TDLoss(nn.Module):
+    """
+    DQN / double DQN loss for a batch of transitions, as a module so it can go through torch.compile or TorchScript.
+
+    The next state passes (the policy picking the next action for double DQN, the target network valuing it) run
+    without autograd, only the policy pass over the current states builds a graph for backward. Concatenating states
+    and new states into one policy pass saves a kernel launch on the GPU, but makes backward run over twice the rows,
+    which on the CPU costs more than it saves.
+
+    Returns (loss, td errors, mean Q value of the batch).
+    """
+
+    def __init__(self, policy_net, target_net, discount, double_dqn):
+        super().__init__()
+        self.policy_net = policy_net
+        self.target_net = target_net
+        self.discount = discount
+        self.double_dqn = double_dqn
+
+    def forward(self, states, actions, new_states, rewards, dones, weights: Optional[torch.Tensor] = None):
+        with torch.no_grad():
+            if self.double_dqn:
+                best_action_from_policy = self.policy_net(new_states).argmax(dim=1)
+                next_q = self.target_net(new_states).gather(dim=1, index=best_action_from_policy.unsqueeze(dim=1))
+                next_q = next_q.squeeze(dim=1)
+            else:
+                next_q = self.target_net(new_states).max(dim=1)[0]
+            target_q = rewards + (1 - dones) * self.discount * next_q
+
+        # calculate the Q value from the current policy
+        current_q = self.policy_net(states).gather(dim=1, index=actions.unsqueeze(dim=1)).squeeze(dim=1)
+
+        td_errors = target_q - current_q
+        if weights is None:
+            loss = (td_errors ** 2).mean()  # mean squared error
+        else:
+            # prioritized replay: scale each sample's squared error by its importance-sampling weight
+            loss = (weights * td_errors ** 2).mean()
+        # the batch's mean Q value is returned for the metrics, detached so reading it later doesn't keep the graph
+        return loss, td_errors.detach(), current_q.detach().mean()
@@ -0,0 +1,130 @@
+import contextlib
+import time
+
+import numpy as np
+
+SUB_BUCKETS = 8  # histogram buckets per power of two, so a percentile is off by at most 1/16th either way
+NUM_BUCKETS = 64 * SUB_BUCKETS  # covers every duration an int64 of nanoseconds can hold
+
+
+def _bucket_bounds():  # returns (lower bound, width) in nanoseconds for every histogram bucket
+    index = np.arange(NUM_BUCKETS)
+    octave, sub = index // SUB_BUCKETS, index % SUB_BUCKETS
+    low = np.where(octave == 0, index, (SUB_BUCKETS + sub) * 2.0 ** (octave - 1))
+    width = np.where(octave == 0, 1, 2.0 ** (octave - 1))
+    return low, width
+
+
+class PhaseTimer:
+    """
+    Context manager timing one phase of the training loop with time.perf_counter_ns.
+
+    Durations go into a fixed-size log-scale histogram (SUB_BUCKETS per power of two, the first few nanoseconds
+    exact) along with a running count, total and max, so memory and the cost of PhaseTimers.report() stay the same
+    however many times a phase runs. Timing a phase costs two clock reads and a few integer ops.
+    A phase is only ever timed from one thread at a time (the learner's phases from the learner thread).
+    """
+
+    __slots__ = ('name', 'counts', 'total', 'max', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * NUM_BUCKETS
+        self.total = 0
+        self.max = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter_ns() - self.start
+        # bucket: the octave from the bit length, the sub bucket from the bits right below the leading one
+        bits = duration.bit_length()
+        if bits > 3:
+            self.counts[(bits - 3) * SUB_BUCKETS + (duration >> (bits - 4)) - SUB_BUCKETS] += 1
+        else:
+            self.counts[duration] += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+
+class PhaseTimers:
+    """
+    Where the time in Agent.run goes: per phase counts, totals and percentiles, logged as a table every
+    report_interval seconds (checked by maybe_report()).
+
+        env_step = timers.phase('env_step')  # once, up front
+        with env_step:
+            ...
+
+    Each table covers the time since the previous one. Phases can nest (tensor conversion is part of acting), so the
+    shares of wall time don't have to add up to 100%. On a GPU, forward and backward only measure launching the work,
+    the wait for it shows up in whichever phase first needs a result.
+    """
+
+    enabled = True
+
+    def __init__(self, report_interval=60, log=print):
+        self.report_interval = report_interval
+        self.log = log
+        self.phases = {}
+        self.bucket_low, self.bucket_width = _bucket_bounds()
+        self.last_report_time = time.perf_counter()
+
+    def phase(self, name):
+        if name not in self.phases:
+            self.phases[name] = PhaseTimer(name)
+        return self.phases[name]
+
+    def maybe_report(self):
+        if time.perf_counter() - self.last_report_time >= self.report_interval:
+            self.report()
+
+    def report(self):
+        now = time.perf_counter()
+        wall = now - self.last_report_time
+        self.last_report_time = now
+        lines = [f"Phase timings over the last {wall:0.1f}s",
+                 f"  {'phase':16s} {'count':>9s} {'total s':>9s} {'%wall':>6s} {'mean us':>9s} {'p50 us':>9s}"
+                 f" {'p90 us':>9s} {'p99 us':>9s} {'max us':>9s}"]
+        for timer in self.phases.values():
+            # taken over and replaced rather than cleared in place, the learner thread may be timing the phase
+            # (at worst a duration recorded right now is lost)
+            counts, total, longest = timer.counts, timer.total, timer.max
+            timer.reset()
+            counts = np.array(counts)
+            count = int(counts.sum())
+            if not count:
+                continue
+            # percentiles at the middle of the bucket they fall in, but never past the longest duration seen
+            cumulative = np.cumsum(counts)
+            buckets = np.searchsorted(cumulative, np.array([0.5, 0.9, 0.99]) * count)
+            percentiles = np.minimum(self.bucket_low[buckets] + self.bucket_width[buckets] / 2, longest)
+            p50, p90, p99 = percentiles / 1000  # microseconds
+            lines.append(f"  {timer.name:16s} {count:9d} {total / 1e9:9.2f} {total / 1e9 / wall * 100:6.1f}"
+                         f" {total / count / 1000:9.1f} {p50:9.1f} {p90:9.1f} {p99:9.1f} {longest / 1000:9.1f}")
+        self.log('\n'.join(lines))
+
+
+class NullTimers:
+    """
+    Stand-in for PhaseTimers when timing is off: every phase is the same do-nothing context manager and reports are
+    skipped, so the instrumented code pays for an empty `with` and nothing else.
+    """
+
+    enabled = False
+    _null_phase = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._null_phase
+
+    def maybe_report(self):
+        pass
+
+    def report(self):
+        pass